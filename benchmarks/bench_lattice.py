@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of bulk lattice generation used by the MSR module.
+
+Compares the broadcasting lattice engine (utils.msr.gen_lattice) with the
+former per-cell loop implementation over a range of particle radii.
+
+Run from the main directory of MOSP:
+    python benchmarks/bench_lattice.py
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.msr import gen_fcc, gen_bcc, gen_hcp
+
+RADII = [5, 10, 20, 40, 80]  # radius of nanoparticle (A)
+
+
+def legacy_make_grid(*args):
+    num_var = len(args)
+    num_permut = int(np.prod([len(arg) for arg in args]))
+    result = np.zeros((num_permut, num_var))
+    for i in range(num_permut):
+        index = i
+        for j in reversed(range(num_var)):
+            sub_index = int(index % len(args[j]))
+            result[i, j] = args[j][sub_index]
+            index /= len(args[j])
+    return result
+
+
+def legacy_gen(dim, prim_block, cell, transform=None):
+    reps = legacy_make_grid(*[range(int(dim / c)) for c in cell])
+    nbasis = prim_block.shape[0]
+    bulk_xyz = np.empty((reps.shape[0] * nbasis, 3), dtype=float)
+    for i, rep in enumerate(reps):
+        disp = rep * cell
+        xyz = prim_block + disp
+        if transform is not None:
+            xyz = np.dot(transform, xyz.T).T
+        bulk_xyz[i * nbasis:i * nbasis + nbasis, :] = xyz
+    center = np.sum(bulk_xyz, axis=0) / bulk_xyz.shape[0]
+    bulk_xyz -= center
+    return bulk_xyz
+
+
+def legacy_gen_fcc(dim, a):
+    prim_block = np.array([[0., 0., 0.], [a / 2, a / 2, 0.0],
+                           [a / 2, 0.0, a / 2], [0.0, a / 2, a / 2]])
+    return legacy_gen(dim, prim_block, np.array([a, a, a]))
+
+
+def legacy_gen_bcc(dim, a):
+    prim_block = np.array([[0., 0., 0.], [a / 2, a / 2, a / 2]])
+    return legacy_gen(dim, prim_block, np.array([a, a, a]))
+
+
+def legacy_gen_hcp(dim, a, c):
+    prim_block = np.array([[a / 3.0, 2.0 * a / 3.0, c / 4.0],
+                           [2.0 * a / 3.0, a / 3.0, 3.0 * c / 4.0]])
+    transform = np.array([[1.0, -0.5, 0.0], [0.0, np.sqrt(3) / 2.0, 0.0], [0.0, 0.0, 1.0]])
+    return legacy_gen(dim, prim_block, np.array([a, a, c]), transform)
+
+
+def timeit(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    cases = [('FCC', gen_fcc, legacy_gen_fcc, (3.9239,)),
+             ('BCC', gen_bcc, legacy_gen_bcc, (2.8665,)),
+             ('HCP', gen_hcp, legacy_gen_hcp, (2.5071, 4.0695))]
+    print('%-5s %8s %10s %12s %12s %9s' %
+          ('', 'radius', 'nAtoms', 'legacy (s)', 'engine (s)', 'speedup'))
+    for name, func, legacy, args in cases:
+        for radius in RADII:
+            # Wulff.geometry builds a cube of side 3 * the smallest plane distance
+            dim = radius * 3
+            t_new, bulk = timeit(func, dim, *args)
+            if bulk.shape[0] < 2000000:
+                t_old, bulk_old = timeit(legacy, dim, *args, repeat=1)
+                assert np.abs(bulk - bulk_old).max() < 1e-9
+                print('%-5s %8.1f %10d %12.4f %12.4f %8.1fx' %
+                      (name, radius, bulk.shape[0], t_old, t_new, t_old / t_new))
+            else:
+                print('%-5s %8.1f %10d %12s %12.4f %9s' %
+                      (name, radius, bulk.shape[0], '-', t_new, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the lattice stage of the MSR module with the lattice cache.
+
+Compares generating the bulk lattice inside the circumradius of the
+particle (an empty utils.msr.LatticeCache, as without cache) with a hit of
+a warm cache, as when the conditions of a sweep shrink the particle a
+little, for the float and integer lattices.
+
+Run from the main directory of MOSP:
+    python benchmarks/bench_lattice_cache.py
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.msr import LatticeCache
+
+RADII = [10, 20, 40, 80, 120]  # radius of nanoparticle (A)
+CIRCUMRADIUS = 1.3  # circumradius of the Wulff shapes of the examples over the radius
+SHRINK = 0.95  # circumradius of the hit over the one of the miss
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    cases = [('FCC', (3.9239,)), ('BCC', (2.8665,)), ('HCP', (2.5071, 4.0695))]
+    print('%-5s %5s %8s %10s %12s %12s %9s %10s' %
+          ('', 'int', 'radius', 'nAtoms', 'no cache (s)', 'hit (s)', 'speedup', 'cache (MB)'))
+    for name, args in cases:
+        for integer in (False, True):
+            if integer and name == 'HCP':
+                continue
+            for radius in RADII:
+                # Wulff.geometry builds a cube of side 3 * the smallest plane distance
+                dim = radius * 3
+                bound = radius * CIRCUMRADIUS
+                t_new, bulk = timeit(LatticeCache(0).get, name, dim, *args,
+                                     radius=bound * SHRINK, integer=integer)
+                cache = LatticeCache()
+                cache.get(name, dim, *args, radius=bound, integer=integer)
+                t_hit, hit = timeit(cache.get, name, dim, *args,
+                                    radius=bound * SHRINK, integer=integer)
+                if integer:
+                    bulk, hit = bulk[0], hit[0]
+                assert cache.misses == 1 and hit.shape == bulk.shape
+                print('%-5s %5s %8.1f %10d %12.4f %12.4f %8.1fx %10.1f' %
+                      (name, integer, radius, bulk.shape[0], t_new, t_hit, t_new / t_hit,
+                       cache.nbytes() / 1024**2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the neighbor search behind surf_count.
+
+Compares utils.neighbor.NeighborGraph with the former all-pairs loop on
+FCC clusters of 1k to 200k atoms (the loop is only run on small ones).
+
+Run from the main directory of MOSP:
+    python benchmarks/bench_neighbor.py
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.msr import gen_fcc
+from utils.neighbor import NeighborGraph
+
+NATOMS = [1000, 5000, 20000, 50000, 100000, 200000]
+LATT_PARAM = 3.9239
+BOND_LENGTH = 1.45 / 2 * LATT_PARAM
+LEGACY_MAX = 20000  # largest cluster handed to the all-pairs loop
+
+
+def legacy_neighbor_lists(coors, cutoff):
+    natoms = coors.shape[0]
+    neighbors = []
+    for i, icoor in enumerate(coors):
+        dist_list = np.sqrt(np.sum((icoor - coors) ** 2, axis=1))
+        icn = np.arange(natoms)[dist_list < cutoff]
+        neighbors.append(icn[icn != i])
+    return neighbors
+
+
+def spherical_cluster(natoms):
+    # FCC holds 4 atoms per a^3
+    radius = (3.0 * natoms * LATT_PARAM**3 / 4.0 / (4.0 * np.pi)) ** (1.0 / 3.0)
+    return gen_fcc(2.0 * radius + 2.0 * LATT_PARAM, LATT_PARAM, radius)
+
+
+def main():
+    print('%10s %12s %12s %9s' % ('nAtoms', 'legacy (s)', 'engine (s)', 'speedup'))
+    for natoms in NATOMS:
+        coors = spherical_cluster(natoms)
+        start = time.perf_counter()
+        graph = NeighborGraph(coors, BOND_LENGTH)
+        t_new = time.perf_counter() - start
+        if coors.shape[0] <= LEGACY_MAX:
+            start = time.perf_counter()
+            legacy = legacy_neighbor_lists(coors, BOND_LENGTH)
+            t_old = time.perf_counter() - start
+            assert all(np.array_equal(legacy[i], graph.neighbors(i))
+                       for i in range(coors.shape[0]))
+            print('%10d %12.4f %12.4f %8.1fx' % (coors.shape[0], t_old, t_new, t_old / t_new))
+        else:
+            print('%10d %12s %12.4f %9s' % (coors.shape[0], '-', t_new, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,27 @@
 @author: yinglei
 """
 
+import io
 import re
-from scipy.optimize import fsolve
-from functools import reduce
+import copy
+import time
+import tracemalloc
+from contextlib import contextmanager
+from scipy.spatial import ConvexHull, HalfspaceIntersection, QhullError
 from itertools import permutations
+from collections import OrderedDict
+from functools import lru_cache
 import warnings
 import numpy as np
 import pandas as pd
+try:
+    from utils.neighbor import NeighborGraph
+    from utils.result_cache import ResultCache, code_version
+    import utils.neighbor as neighbor
+except ImportError:
+    from neighbor import NeighborGraph
+    from result_cache import ResultCache, code_version
+    import neighbor
 
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
@@ -17,6 +31,20 @@ R = 8.314
 P0 = 100000
 unit_coversion = 0.0000103643
 k_b = 0.000086173303
+CHUNK_SIZE = 65536  # number of atoms carved at a time in gen_cluster
+LATTICE_CACHE_BYTES = 512 * 1024**2  # size limit of the bulk lattice cache
+LATTICE_CACHE_SLACK = 1.1  # cached lattices reach this times the requested radius
+RESULT_CACHE_DIR = 'data/CACHE'  # results of previous runs, see Wulff.run
+RESULT_CACHE_BYTES = 256 * 1024**2  # size limit of the result cache
+FACE_COLORS = {'100': 'Au', '110': 'Cu', '111': 'Fe'}  # element used to color each facet, 'Rh' otherwise
+# site types shared by all particles, faces are appended by Wulff.mark_atoms
+SITE_TYPES = (' bulk', 'subsurface', 'edge', 'corner', 'unkonwn')
+SITE_COLORS = ('Co', 'O', 'Pt', 'Pd', 'O')  # element used to color each site type
+COVERAGE_STEPS = 10  # continuation steps of the coverage solver
+COVERAGE_RESTARTS = 20  # random restarts of the coverage solver
+COVERAGE_TABLE_SIZE = 41  # grid points of coverage tables along T and ln(P)
+COVERAGE_TABLE_SAFETY = 1.25  # factor on the sampled interpolation error of coverage tables
+SITE_BULK, SITE_SUBSURFACE, SITE_EDGE, SITE_CORNER, SITE_UNKNOWN = range(len(SITE_TYPES))
 
 
 # pause if warning
@@ -38,173 +66,750 @@ def hcf(x, y):
     return x
 
 
+def cubic_ops():
+    # point group m-3m acting on Miller indices (hkl): signed permutations
+    ops = []
+    for perm in permutations(range(3)):
+        for signs in np.ndindex(2, 2, 2):
+            g = np.zeros((3, 3), dtype=np.int8)
+            g[range(3), perm] = np.where(np.array(signs) == 1, -1, 1)
+            ops.append(g)
+    return np.array(ops)
+
+
+def hexagonal_ops():
+    # point group 6/mmm acting on Miller indices (hkl): signed permutations
+    # of (h, k, i) of the four-index notation, with i = -(h + k), and l -> +-l
+    hki = np.array([[1, 0, 0], [0, 1, 0], [-1, -1, 0]], dtype=np.int8)
+    ops = []
+    for perm in permutations(range(3)):
+        for s in (1, -1):
+            for t in (1, -1):
+                g = np.zeros((3, 3), dtype=np.int8)
+                g[:2] = s * hki[list(perm[:2])]
+                g[2, 2] = t
+                ops.append(g)
+    return np.array(ops)
+
+
+POINT_GROUPS = {'FCC': cubic_ops(), 'BCC': cubic_ops(), 'HCP': hexagonal_ops()}
+# basis of the cubic cells on the integer grid of a / 4
+CUBIC_BASIS_INT = {'FCC': [[0, 0, 0], [2, 2, 0], [2, 0, 2], [0, 2, 2]], 'BCC': [[0, 0, 0], [2, 2, 2]]}
+
+
+def parse_index(index, structure):
+    '''
+    Miller indices (h, k, l) of a face given as a string ('111', '1-10') or
+    a sequence, HCP faces may also be given in four-index notation (hkil)
+    raise ValueError if index is not valid
+    '''
+    if isinstance(index, str):
+        index = [int(s) for s in re.findall(r"-*[0-9]", index)]
+    index = tuple(int(i) for i in index)
+    if len(index) == 4 and structure == 'HCP':
+        h, k, i, l = index
+        if i != -(h + k):
+            raise ValueError(f"i of ({h}{k}{i}{l}) must be -(h + k)")
+        index = (h, k, l)
+    if len(index) != 3 or not any(index):
+        raise ValueError(f"{index} is not a face index")
+    return index
+
+
+@lru_cache(maxsize=None)
+def plane_family(index, structure):
+    '''
+    Miller indices (int8, planes x 3) of the planes equivalent to index
+    under the point group of structure, computed once per index and
+    structure and shared by every caller (the array is read-only)
+    '''
+    hkl = np.array(parse_index(index, structure))
+    family = np.unique(POINT_GROUPS[structure] @ hkl, axis=0)[::-1].astype(np.int8)
+    family.setflags(write=False)
+    return family
+
+
+@lru_cache(maxsize=None)
+def plane_normals(index, structure, c_over_a=None):
+    '''
+    Cartesian normals of the plane family of index, in the frame of
+    gen_fcc/gen_bcc/gen_hcp: the Miller indices for cubic structures,
+    h b1 + k b2 + l b3 (reciprocal basis of the HCP cell) for HCP
+    '''
+    family = plane_family(index, structure)
+    if structure != 'HCP':
+        return family
+    reciprocal = np.array([[1.0, 1.0 / np.sqrt(3.0), 0.0],
+                           [0.0, 2.0 / np.sqrt(3.0), 0.0],
+                           [0.0, 0.0, 1.0 / c_over_a]])
+    normals = np.round(family @ reciprocal, 12) + 0.0
+    normals.setflags(write=False)
+    return normals
+
+
 def get_planes(index, structure):
     # based on structure, return family of crystal planes
-    planes = []
-    index = list(index)
-    h, k, l = float(index[0]), float(index[1]), float(index[2])
-    if structure == 'BCC' or structure == 'FCC':
-        for _ in range(2):
-            h *= -1
-            for _ in range(2):
-                k *= -1
-                for _ in range(2):
-                    l *= -1
-                    for item in permutations([h, k, l]):
-                        planes.append(item)
+    return [tuple(p) for p in plane_family(index, structure).tolist()]
+
+
+def gen_lattice(dim, prim_block, cell, transform=None, radius=None):
+    '''
+    replicate prim_block over a box of side dim
+    cell holds the repeat length along each axis, the number of replicas
+    along axis i is int(dim / cell[i])
+    cells are ordered x-major (z varies the fastest) and each cell holds
+    the basis atoms in the order of prim_block
+    transform maps coordinates along the cell axes to cartesian ones
+    coordinates are centered at the mean position of the box
+    if radius is given, only atoms within radius of the center are kept,
+    and the box is built one slab of cells at a time
+    '''
+    cell = np.asarray(cell, dtype=float)
+    prim_block = np.asarray(prim_block, dtype=float)
+    reps = [int(dim / c) for c in cell]
+    if radius is None:
+        disp = np.indices(reps, dtype=float).reshape(3, -1).T * cell
+        bulk_xyz = (prim_block[np.newaxis, :, :] + disp[:, np.newaxis, :]).reshape(-1, 3)
+        if transform is not None:
+            bulk_xyz = bulk_xyz @ transform.T
+        center = np.sum(bulk_xyz, axis=0) / bulk_xyz.shape[0]
+        bulk_xyz -= center
+        return bulk_xyz
+
+    # mean position of the box, known without building it
+    center = np.mean(prim_block, axis=0) + cell * (np.array(reps) - 1) / 2.0
+    if transform is not None:
+        center = transform @ center
+    slab_disp = np.indices(reps[1:], dtype=float).reshape(2, -1).T * cell[1:]
+    disp = np.zeros((slab_disp.shape[0], 3))
+    disp[:, 1:] = slab_disp
+    slabs = [np.empty((0, 3))]
+    for i in range(reps[0]):
+        disp[:, 0] = i * cell[0]
+        xyz = (prim_block[np.newaxis, :, :] + disp[:, np.newaxis, :]).reshape(-1, 3)
+        if transform is not None:
+            xyz = xyz @ transform.T
+        xyz -= center
+        slabs.append(xyz[np.sum(xyz**2, axis=1) <= radius**2])
+    return np.concatenate(slabs)
+
+
+def lattice_params(structure, latt_param_a, latt_param_c=0.0):
+    '''
+    return the basis (prim_block), the repeat length along each axis (cell)
+    and the transform to cartesian coordinates (None if the axes are
+    cartesian) of the bulk lattice of structure
+    '''
+    a, c = latt_param_a, latt_param_c
+    if structure == 'FCC':
+        prim_block = np.array([[0., 0., 0.], [a / 2, a / 2, 0.0],
+                               [a / 2, 0.0, a / 2], [0.0, a / 2, a / 2]])
+        return prim_block, np.array([a] * 3), None
+    elif structure == 'BCC':
+        prim_block = np.array([[0., 0., 0.], [a / 2, a / 2, a / 2]])
+        return prim_block, np.array([a] * 3), None
     elif structure == 'HCP':
-        H = (2 * h - k) / 3
-        K = (2 * k - h) / 3
-        I = -(H + K)
-        L = l
-        for _ in range(2):
-            H *= -1
-            for _ in range(2):
-                K *= -1
-                for _ in range(2):
-                    I *= -1
-                    for _ in range(2):
-                        L *= -1
-                        for item in permutations([H, K, I, L]):
-                            h = int((item[0] - item[2]) * 3)
-                            k = int((item[1] - item[2]) * 3)
-                            l = int(item[3] * 3)
-                            divisor = hcf(hcf(abs(h), abs(k)), abs(l))
-                            h /= divisor
-                            k /= divisor
-                            l /= divisor
-                            planes.append((h, k, l))
-    # Remove duplicate entries
-    planes = list(set(planes))
-    return planes
-
-
-def make_grid(*args):
-    '''
-    make grid of list of arguments
-    suppose we have 4 arguments, each has [M, N, P, Q] entries
-    the q arguments vary the fastest
-    for an arbitrary permute [m, n, p, q], the index is
-    q + pQ + nPQ + mNPQ = q+Q(p+P(n+mN))
-    '''
-    num_var = len(args)
-    num_permut = int(reduce(lambda count, arg: count * len(arg), args, 1))
-    result = np.zeros((num_permut, num_var))
-    for i in range(num_permut):
-        index = i
-        for j in reversed(range(num_var)):
-            sub_index = int(index % len(args[j]))
-            result[i, j] = args[j][sub_index]
-            index /= len(args[j])
-    return result
-
-
-def gen_fcc(dim, latt_param):
+        prim_block = np.array([[a / 3.0, 2.0 * a / 3.0, c / 4.0],
+                               [2.0 * a / 3.0, a / 3.0, 3.0 * c / 4.0]])
+        # (a1, a2, c) -> (x, y, z)
+        coord_transform = np.array([[1.0, -0.5, 0.0], [0.0, np.sqrt(3) / 2.0, 0.0],
+                                    [0.0, 0.0, 1.0]])
+        return prim_block, np.array([a, a, c]), coord_transform
+    raise ValueError(f"Unknown crystal structure {structure}")
+
+
+def gen_fcc(dim, latt_param, radius=None):
     '''
     generate fcc structure
     dim of length 3
     '''
-    dim = [dim] * 3
-    x_dim, y_dim, z_dim = dim
-    x_rep, y_rep, z_rep = int(x_dim / latt_param), int(y_dim / latt_param), int(
-        z_dim / latt_param)
-    prim_block = np.array([[0., 0., 0.], [latt_param / 2, latt_param / 2, 0.0],
-                           [latt_param / 2, 0.0, latt_param / 2],
-                           [0.0, latt_param / 2, latt_param / 2]])
-    reps = make_grid(range(x_rep), range(y_rep), range(z_rep))
-    bulk_xyz = np.empty((reps.shape[0] * 4, 3), dtype=float)
-    for i, rep in enumerate(reps):
-        disp = rep * latt_param
-        bulk_xyz[i * 4:i * 4 + 4, :] = prim_block + disp
-    center = np.sum(bulk_xyz, axis=0) / bulk_xyz.shape[0]
-    bulk_xyz -= center
-    return bulk_xyz
-
-
-def gen_bcc(dim, latt_param):
+    prim_block, cell, _ = lattice_params('FCC', latt_param)
+    return gen_lattice(dim, prim_block, cell, radius=radius)
+
+
+def gen_bcc(dim, latt_param, radius=None):
     '''
     generate bcc structure
     dim of length 3
     '''
-    dim = [dim] * 3
-    x_dim, y_dim, z_dim = dim
-    x_rep, y_rep, z_rep = int(x_dim / latt_param), int(y_dim / latt_param), int(
-        z_dim / latt_param)
-    prim_block = np.array([[0., 0., 0.], [latt_param / 2, latt_param / 2,
-                                          latt_param / 2]])
-    reps = make_grid(range(x_rep), range(y_rep), range(z_rep))
-    bulk_xyz = np.empty((reps.shape[0] * 2, 3), dtype=float)
-    for i, rep in enumerate(reps):
-        disp = rep * latt_param
-        bulk_xyz[i * 2:i * 2 + 2, :] = prim_block + disp
-    center = np.sum(bulk_xyz, axis=0) / bulk_xyz.shape[0]
-    bulk_xyz -= center
-    return bulk_xyz
+    prim_block, cell, _ = lattice_params('BCC', latt_param)
+    return gen_lattice(dim, prim_block, cell, radius=radius)
 
 
-def gen_hcp(dim, latt_param_a, latt_param_c):
+def gen_hcp(dim, latt_param_a, latt_param_c, radius=None):
     '''
     generate hcp structure
     dim of length 3
     '''
-    dim = [dim] * 3
-    x_dim, y_dim, z_dim = dim
-    x_rep, y_rep, z_rep = int(x_dim / latt_param_a), int(y_dim / latt_param_a), int(
-        z_dim / latt_param_c)
-    prim_block = np.array(
-        [[latt_param_a / 3.0, 2.0 * latt_param_a / 3.0, latt_param_c / 4.0],
-         [2.0 * latt_param_a / 3.0, latt_param_a / 3.0, 3.0 * latt_param_c / 4.0]])
-    reps = make_grid(range(x_rep), range(y_rep), range(z_rep))
-    bulk_xyz = np.empty((reps.shape[0] * 2, 3), dtype=float)
-    coord_transform = [[1.0, -0.5, 0.0], [0.0, np.sqrt(3) / 2.0, 0.0], [0.0, 0.0, 1.0]]
-    for i, rep in enumerate(reps):
-        dist = [latt_param_a * rep[0], latt_param_a * rep[1], latt_param_c * rep[2]]
-        a1a2c = prim_block + dist
-        xyz = np.mat(coord_transform) * np.mat(a1a2c).T
-        bulk_xyz[i * 2:i * 2 + 2, :] = xyz.T
-    center = np.sum(bulk_xyz, axis=0) / bulk_xyz.shape[0]
-    bulk_xyz -= center
-    return bulk_xyz
-
-
-def gen_cluster(bulk_xyz, planes, length, d):
+    prim_block, cell, coord_transform = lattice_params('HCP', latt_param_a, latt_param_c)
+    return gen_lattice(dim, prim_block, cell, transform=coord_transform, radius=radius)
+
+
+def gen_lattice_int(dim, prim_block, cell, unit, radius=None):
+    '''
+    integer version of gen_lattice
+    prim_block and cell are given in multiples of unit (A), and so are
+    the returned int32 coordinates
+    the mean position of the box must fall on the integer grid
+    '''
+    prim_block = np.asarray(prim_block, dtype=np.int32)
+    cell = np.asarray(cell, dtype=np.int32)
+    reps = [int(dim / (c * unit)) for c in cell]
+    center = np.sum(prim_block, axis=0) / prim_block.shape[0] + cell * (np.array(reps) - 1) / 2.0
+    if (center % 1 != 0).any():
+        raise ValueError("center of the lattice is not on the integer grid")
+    center = center.astype(np.int32)
+    slab_disp = (np.indices(reps[1:], dtype=np.int32).reshape(2, -1).T * cell[1:])
+    disp = np.zeros((slab_disp.shape[0], 3), dtype=np.int32)
+    disp[:, 1:] = slab_disp - center[1:]
+    slabs = [np.empty((0, 3), dtype=np.int32)]
+    for i in range(reps[0]):
+        disp[:, 0] = i * cell[0] - center[0]
+        xyz = (prim_block[np.newaxis, :, :] + disp[:, np.newaxis, :]).reshape(-1, 3)
+        if radius is not None:
+            r2 = np.sum(xyz.astype(np.int64)**2, axis=1)
+            xyz = xyz[r2 * unit**2 <= radius**2]
+        slabs.append(xyz)
+    return np.concatenate(slabs)
+
+
+def gen_fcc_int(dim, latt_param, radius=None):
+    '''
+    generate fcc structure on the integer grid of latt_param / 4
+    return int32 coordinates and the grid unit
+    '''
+    unit = latt_param / 4
+    return gen_lattice_int(dim, CUBIC_BASIS_INT['FCC'], [4] * 3, unit, radius), unit
+
+
+def gen_bcc_int(dim, latt_param, radius=None):
+    '''
+    generate bcc structure on the integer grid of latt_param / 4
+    return int32 coordinates and the grid unit
+    '''
+    unit = latt_param / 4
+    return gen_lattice_int(dim, CUBIC_BASIS_INT['BCC'], [4] * 3, unit, radius), unit
+
+
+def gen_cubic_int(structure, dim, latt_param, radius=None, wedge=False):
+    '''
+    FCC or BCC lattice on the integer grid of latt_param / 4, with the
+    replicas of gen_fcc_int/gen_bcc_int but the box of side replicas *
+    latt_param centered on an atom instead of its mean position, so that
+    the 48 operations of m-3m (signed permutations of the axes) map it
+    onto itself
+    if wedge, only the cells of the irreducible wedge x >= y >= z >= 0 are
+    enumerated (1/48 of the box) and only the atoms in it are returned
+    cells are ordered x-major (z varies the fastest) and each cell holds
+    the basis atoms in the order of CUBIC_BASIS_INT
+    return int32 coordinates and the grid unit
+    '''
+    unit = latt_param / 4
+    prim_block = np.array(CUBIC_BASIS_INT[structure], dtype=np.int32)
+    half = 4 * int(dim / latt_param) // 2
+    ncell = half // 4
+    if not wedge:
+        slab_disp = np.indices((2 * ncell + 2,) * 2, dtype=np.int32).reshape(2, -1).T - ncell - 1
+    slabs = [np.empty((0, 3), dtype=np.int32)]
+    for i in range(0, ncell + 1) if wedge else range(-ncell - 1, ncell + 1):
+        if wedge:
+            # cells with i >= j >= k >= 0 hold the atoms of the wedge
+            slab_disp = np.column_stack(np.tril_indices(i + 1)).astype(np.int32)
+        disp = np.column_stack((np.full(slab_disp.shape[0], i, dtype=np.int32), slab_disp)) * 4
+        xyz = (prim_block[np.newaxis, :, :] + disp[:, np.newaxis, :]).reshape(-1, 3)
+        keep = (np.abs(xyz) <= half).all(axis=1)
+        if wedge:
+            keep &= (xyz[:, 0] >= xyz[:, 1]) & (xyz[:, 1] >= xyz[:, 2]) & (xyz[:, 2] >= 0)
+        if radius is not None:
+            keep &= np.sum(xyz.astype(np.int64)**2, axis=1) * unit**2 <= radius**2
+        slabs.append(xyz[keep])
+    return np.concatenate(slabs), unit
+
+
+def gen_bulk(structure, dim, latt_param_a, latt_param_c=0.0, radius=None, integer=False):
+    '''
+    gen_fcc/gen_bcc/gen_hcp (or gen_fcc_int/gen_bcc_int if integer) of structure
+    '''
+    if structure == 'FCC':
+        return gen_fcc_int(dim, latt_param_a, radius) if integer else gen_fcc(dim, latt_param_a, radius)
+    elif structure == 'BCC':
+        return gen_bcc_int(dim, latt_param_a, radius) if integer else gen_bcc(dim, latt_param_a, radius)
+    return gen_hcp(dim, latt_param_a, latt_param_c, radius)
+
+
+def lattice_cells(bulk_xyz, prim_block, cell, transform, reps):
+    '''
+    index (int16) of the replica holding each atom of a lattice of reps
+    replicas made by gen_lattice (or gen_lattice_int, with prim_block and
+    cell in multiples of its unit)
+    '''
+    frac = bulk_xyz if transform is None else bulk_xyz @ np.linalg.inv(transform).T
+    center = np.mean(prim_block, axis=0) + cell * (np.asarray(reps) - 1) / 2.0
+    return np.floor((frac + center) / cell + 1e-9).astype(np.int16)
+
+
+class LatticeCache:
+    '''
+    LRU cache of bulk lattices keyed on (structure, a, c, integer, replicas)
+    a lattice requested with a radius is generated (and cached) within
+    LATTICE_CACHE_SLACK times that radius, so small changes of the Wulff
+    shape with the conditions still hit while memory stays bounded by the
+    sphere; a lattice requested without radius is cached whole
+    each entry keeps the squared distance to the center and the replica
+    of each atom, so a hit with a smaller radius or fewer replicas
+    (differing by an even number along each axis) is a single mask
+    cached lattices are read-only and returned as they are when the mask
+    keeps every atom
+    maxbytes limits the total size of the cached arrays
+    '''
+    def __init__(self, maxbytes=LATTICE_CACHE_BYTES):
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()  # key -> (bulk, r2, cells, radius)
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def nbytes(self):
+        return sum(bulk.nbytes + r2.nbytes + cells.nbytes
+                   for bulk, r2, cells, _ in self.entries.values())
+
+    def get(self, structure, dim, latt_param_a, latt_param_c=0.0, radius=None, integer=False):
+        '''
+        same as gen_fcc/gen_bcc/gen_hcp (or gen_fcc_int/gen_bcc_int if integer)
+        '''
+        prim_block, cell, transform = lattice_params(structure, latt_param_a, latt_param_c)
+        reps = np.array([int(dim / c) for c in cell])
+        volume = np.prod(cell) * (1.0 if transform is None else abs(np.linalg.det(transform)))
+        unit = 1.0
+        if integer:
+            unit = latt_param_a / 4
+            prim_block, cell = prim_block / unit, cell / unit
+        for key in reversed(self.entries):
+            cached_reps = np.array(key[-1])
+            bulk, r2, cells, cached_radius = self.entries[key]
+            if key[:-1] != (structure, latt_param_a, latt_param_c, integer) \
+                    or (cached_reps < reps).any() or ((cached_reps - reps) % 2).any():
+                continue
+            if cached_radius is not None and (radius is None or cached_radius < radius):
+                continue
+            self.entries.move_to_end(key)
+            self.hits += 1
+            break
+        else:
+            self.misses += 1
+            cached_radius = None if radius is None else radius * LATTICE_CACHE_SLACK
+            natoms = np.prod(reps) * prim_block.shape[0]
+            if cached_radius is not None:
+                natoms = min(natoms, prim_block.shape[0] / volume * 4.0 / 3.0 * np.pi * cached_radius**3)
+            # coordinates, squared distances and replicas of each atom
+            if natoms * ((4 if integer else 8) * 3 + 8 + 6) > self.maxbytes:
+                # too large to be cached, only generate the atoms inside radius
+                return gen_bulk(structure, dim, latt_param_a, latt_param_c, radius, integer)
+            bulk = gen_bulk(structure, dim, latt_param_a, latt_param_c, cached_radius, integer)
+            if integer:
+                bulk = bulk[0]
+            r2 = np.sum(bulk.astype(np.result_type(bulk, np.int64))**2, axis=1)
+            cells = lattice_cells(bulk, prim_block, cell, transform, reps)
+            for array in (bulk, r2, cells):
+                array.setflags(write=False)
+            cached_reps = reps
+            key = (structure, latt_param_a, latt_param_c, integer, tuple(reps))
+            self.entries[key] = (bulk, r2, cells, cached_radius)
+            while self.nbytes() > self.maxbytes:
+                self.entries.popitem(last=False)
+
+        mask = None
+        if radius is not None and radius != cached_radius:
+            mask = r2 * unit**2 <= radius**2
+        if (cached_reps != reps).any():
+            shift = (cached_reps - reps) // 2
+            in_box = ((cells >= shift) & (cells < shift + reps)).all(axis=1)
+            mask = in_box if mask is None else mask & in_box
+        if mask is not None and not mask.all():
+            bulk = bulk[mask]
+        return (bulk, unit) if integer else bulk
+
+
+lattice_cache = LatticeCache()
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_BYTES,
+                           code_version([__file__, neighbor.__file__]))
+
+
+def wulff_shape(planes, length):
+    '''
+    polyhedron bounded by planes, where plane i lies at distance length[i]
+    from the origin
+    return the vertices, the facet area of each plane and the volume,
+    or None if the planes do not enclose a finite polyhedron
+    '''
+    normals = np.array(planes, dtype=float)
+    normals /= np.sqrt(np.sum(normals**2, axis=1))[:, np.newaxis]
+    # bounded only if the origin lies strictly inside the hull of the normals
+    try:
+        hull = ConvexHull(normals)
+    except QhullError:
+        return None
+    if not (hull.equations[:, -1] < 0).all():
+        return None
+    halfspaces = np.column_stack((normals, -np.asarray(length, dtype=float)))
+    vertices = HalfspaceIntersection(halfspaces, np.zeros(3)).intersections
+    hull = ConvexHull(vertices)
+    # area of each hull triangle goes to the plane it lies on
+    triangles = vertices[hull.simplices]
+    tri_areas = 0.5 * np.sqrt(np.sum(np.cross(triangles[:, 1] - triangles[:, 0],
+                                              triangles[:, 2] - triangles[:, 0])**2, axis=1))
+    on_plane = np.argmax(hull.equations[:, :3] @ normals.T, axis=1)
+    areas = np.bincount(on_plane, weights=tri_areas, minlength=normals.shape[0])
+    return vertices[hull.vertices], areas, hull.volume
+
+
+def circumradius(planes, length):
+    '''
+    radius of the sphere circumscribing the polyhedron bounded by planes,
+    where plane i lies at distance length[i] from the origin
+    return None if the planes do not enclose a finite polyhedron
+    '''
+    shape = wulff_shape(planes, length)
+    if shape is None:
+        return None
+    return np.max(np.sqrt(np.sum(shape[0]**2, axis=1)))
+
+
+def gen_cluster(bulk_xyz, planes, length, d, chunk_size=CHUNK_SIZE):
+    '''
+    carve the cluster out of bulk_xyz, chunk_size atoms at a time
+    the first pass only keeps the indices of the atoms under all planes,
+    their distances are then written chunk by chunk into one array, so
+    apart from it memory is bounded by chunk_size
+    return the distance of the kept atoms to each plane and their indices
+    '''
     planes = np.array(planes).T
     planes_norm = np.sqrt(np.sum(planes**2, axis=0))
-    distance = np.dot(bulk_xyz, planes) / planes_norm
-    under_plane_mask = np.sum(distance > length,
-                              axis=1) == 0
-    valid_atoms = np.arange(bulk_xyz.shape[0])[under_plane_mask]
+    valid_atoms = [np.empty(0, dtype=int)]
+    for start in range(0, bulk_xyz.shape[0], chunk_size):
+        distance = np.dot(bulk_xyz[start:start + chunk_size], planes) / planes_norm
+        under_plane_mask = np.sum(distance > length,
+                                  axis=1) == 0
+        valid_atoms.append(start + np.flatnonzero(under_plane_mask))
+    valid_atoms = np.concatenate(valid_atoms)
+    distance = np.empty((valid_atoms.shape[0], planes.shape[1]))
+    for start in range(0, valid_atoms.shape[0], chunk_size):
+        chunk = distance[start:start + chunk_size]
+        np.dot(bulk_xyz[valid_atoms[start:start + chunk_size]], planes, out=chunk)
+        chunk /= planes_norm
     return distance, valid_atoms
 
 
-def surf_count(coors, distance_threshold, strucutre):
-    natoms = coors.shape[0]
-    cn_mat = np.zeros((natoms, 13), dtype=int) # matrix of coordinate atoms
-    coor_number = np.zeros(natoms, dtype=float)
-    for i, icoor in enumerate(coors):
-        dist_list = np.sqrt(np.sum((icoor - coors) ** 2, axis=1)) # list of distance
-        coor_number[i] = np.sum(dist_list < distance_threshold) - 1 # list of coordinate number
-        icn = np.arange(natoms)[dist_list < distance_threshold] # list of coordinate atoms
-        idx = np.argwhere(icn == i) 
-        icn = np.delete(icn, idx)  # delete the element which equal to i
-        cn_mat[i][0] = icn.shape[0] 
-        cn_mat[i, 1: 1 + icn.shape[0]] = icn
-    accum_cn_mat = np.zeros(natoms, dtype=float)
-    gcn = np.zeros(natoms, dtype=float)
-    for i, line in enumerate(cn_mat):
-        for j in range(1, line[0] + 1):
-            accum_cn_mat[i] += cn_mat[cn_mat[i, j], 0]
-        if strucutre == 'BCC':
-            gcn[i] = accum_cn_mat[i]/8.0
-            nsurf = np.sum(coor_number < 7)
-            surfcn = float(np.sum(cn_mat[:, 0][cn_mat[:, 0] < 7])) / nsurf
-        else:
-            gcn[i] = accum_cn_mat[i]/12.0
-            nsurf = np.sum(coor_number < 10)
-            surfcn = float(np.sum(cn_mat[:, 0][cn_mat[:, 0] < 10])) / nsurf
+def gen_cluster_int(bulk_int, unit, planes, length):
+    '''
+    integer version of gen_cluster, bulk_int holds coordinates in
+    multiples of unit
+    the half-space tests are exact integer dot products, distances are
+    only computed for the atoms kept
+    '''
+    planes = np.rint(np.array(planes)).astype(np.int32)
+    planes_norm = np.sqrt(np.sum(planes.astype(float)**2, axis=1))
+    # n.x / |n| <= length  <=>  n.u <= floor(length * |n| / unit)
+    threshold = np.floor(np.asarray(length) * planes_norm / unit).astype(np.int64)
+    under_plane_mask = np.ones(bulk_int.shape[0], dtype=bool)
+    for plane, thr in zip(planes, threshold):
+        under_plane_mask &= (bulk_int @ plane) <= thr
+    valid_atoms = np.flatnonzero(under_plane_mask)
+    distance = (bulk_int[valid_atoms] @ planes.T) * (unit / planes_norm)
+    return distance, valid_atoms
+
+
+def symmetric_planes(planes, length, ops):
+    '''
+    True if each operation of ops maps every plane onto a plane of the
+    same length
+    '''
+    planes = np.rint(np.array(planes)).astype(np.int32)
+    plane_length = {tuple(p): l for p, l in zip(planes.tolist(), length)}
+    return all(plane_length.get(tuple(p)) == l
+               for g in ops for p, l in zip((planes @ g.T).tolist(), length))
+
+
+def gen_cluster_sym(wedge_int, unit, planes, length, structure):
+    '''
+    carve the cluster out of the atoms of the irreducible wedge of m-3m
+    (gen_cubic_int with wedge) and expand it by the 48 operations, planes
+    and their lengths must be invariant under them (symmetric_planes)
+    the cluster is atom for atom, in the same order, the one gen_cluster_int
+    carves out of the whole box of gen_cubic_int
+    return its int32 coordinates and their distances to each plane
+    '''
+    distance, valid_atoms = gen_cluster_int(wedge_int, unit, planes, length)
+    seeds = wedge_int[valid_atoms]
+    ops = POINT_GROUPS[structure].astype(np.int32)
+    images = (seeds @ ops.transpose(0, 2, 1)).reshape(-1, 3)
+    # atoms on the mirror planes have several images, keep one of each in
+    # the order of the whole box: cell x-major, then basis atom
+    prim_block = np.array(CUBIC_BASIS_INT[structure])
+    basis_table = np.zeros(4**3, dtype=np.int64)
+    basis_table[prim_block @ [16, 4, 1]] = np.arange(prim_block.shape[0])
+    cells = images // 4
+    basis = basis_table[(images - cells * 4) @ np.array([16, 4, 1], dtype=np.int32)]
+    cells = (cells - cells.min(axis=0, initial=0)).astype(np.int64)
+    width = cells.max(axis=0, initial=0) + 1
+    key = ((cells[:, 0] * width[1] + cells[:, 1]) * width[2] + cells[:, 2]) \
+        * prim_block.shape[0] + basis
+    _, first = np.unique(key, return_index=True)
+    # g x.n = x.g^T n and |g^T n| = |n|, so the distances of the image of a
+    # seed by g are the ones of the seed to the planes g^T n
+    planes = np.rint(np.array(planes)).astype(np.int32)
+    plane_index = {tuple(p): i for i, p in enumerate(planes.tolist())}
+    perms = np.array([[plane_index[tuple(p)] for p in (planes @ g).tolist()] for g in ops])
+    op, seed = np.divmod(first, seeds.shape[0]) if seeds.shape[0] else (first, first)
+    return images[first], distance[seed[:, np.newaxis], perms[op]]
+
+
+def surf_count(coors, distance_threshold, strucutre, graph=None):
+    # graph: NeighborGraph of coors, built here if not given
+    if graph is None:
+        graph = NeighborGraph(coors, distance_threshold)
+    counts = graph.coordination()
+    coor_number = counts.astype(float) # list of coordinate number
+    accum_cn = graph.adjacency @ counts # sum of coordinate number of the neighbors
+    if strucutre == 'BCC':
+        gcn = accum_cn / 8.0
+        nsurf = np.sum(coor_number < 7)
+        surfcn = float(np.sum(counts[counts < 7])) / nsurf
+    else:
+        gcn = accum_cn / 12.0
+        nsurf = np.sum(coor_number < 10)
+        surfcn = float(np.sum(counts[counts < 10])) / nsurf
     return (coor_number, gcn, nsurf, surfcn)
 
 
+def coverage_newton(y, ln_g0, w_kT, tol=1e-10, max_iter=50):
+    '''
+    Newton iterations on y = ln(theta_1), ..., ln(theta_ngas), ln(theta_vacancy)
+    of each face (rows of y) with a backtracking line search on the residual
+    w_kT: lateral interactions in units of kT
+    returns y and converged flags
+    '''
+    nface, ngas = ln_g0.shape
+
+    def residual(y):
+        theta = np.exp(y)
+        total = np.sum(theta, axis=1)
+        res = np.empty((y.shape[0], ngas + 1))
+        lateral = np.matmul(w_kT, theta[:, :ngas, None])[..., 0]
+        res[:, :ngas] = y[:, :ngas] + ln_g0 - lateral - y[:, ngas:]
+        res[:, ngas] = np.log(total)
+        return res, theta, total
+
+    jac = np.zeros((nface, ngas + 1, ngas + 1))
+    jac[:, :ngas, ngas] = -1.0
+    eye = np.eye(ngas)
+    converged = np.zeros(nface, dtype=bool)
+    with np.errstate(over='ignore', invalid='ignore'):
+        res, theta, total = residual(y)
+        norm = np.sum(res**2, axis=1)
+        for _ in range(max_iter):
+            converged = np.max(np.abs(res), axis=1) < tol
+            if converged.all():
+                break
+            jac[:, :ngas, :ngas] = eye - w_kT * theta[:, None, :ngas]
+            jac[:, ngas] = theta / total[:, None]
+            try:
+                step = np.linalg.solve(jac, -res[..., None])[..., 0]
+            except np.linalg.LinAlgError:
+                break
+            # backtrack the faces whose residual does not decrease
+            t = np.ones(nface)
+            for _ in range(10):
+                y_new = y + t[:, None] * step
+                res_new, theta_new, total_new = residual(y_new)
+                norm_new = np.sum(res_new**2, axis=1)
+                worse = ~(norm_new <= (1.0 - 1e-4 * t) * norm) & ~converged
+                if not worse.any():
+                    break
+                t[worse] *= 0.5
+            y, res, theta, total, norm = y_new, res_new, theta_new, total_new, norm_new
+    return y, converged & np.isfinite(y).all(axis=1)
+
+
+def solve_coverage(T, E_ads, S_ads, w, S_gas, rPP, dissociative, tol=1e-10, max_iter=50,
+                   steps=COVERAGE_STEPS, restarts=COVERAGE_RESTARTS, seed=0, guess=None):
+    '''
+    coverage of each gas on each face at adsorption equilibrium:
+    theta_k * g_k(theta) = theta_vacancy and sum(theta) + theta_vacancy = 1,
+    with ln g_k = (E_ads_k - (w theta)_k) / kT - (S_ads_k - S_gas_k) / (n k_b)
+    - ln(P_k) / n, n = 2 for dissociative adsorption and 1 otherwise
+    all faces are solved at once by Newton iterations on ln(theta) with the
+    analytic Jacobian, starting from the Langmuir coverage (w = 0)
+    guess: (theta, theta of vacancies) of a nearby solution (e.g. at close
+    T and P) to start from instead of the Langmuir coverage
+    faces not converged are solved again by continuation, turning on the
+    lateral interactions in steps, then from restarts random points
+    drawn with seed; at most max_iter * (2 + steps + restarts) iterations
+    E_ads, S_ads: (faces x gases), w: (faces x gases x gases), T, S_gas and
+    rPP may also be given per face to solve several conditions at once
+    gases of zero partial pressure have theta = 0, the others are solved
+    without them
+    returns theta (faces x gases), theta of vacancies, converged flags
+    '''
+    nface, ngas = E_ads.shape
+    absent = np.broadcast_to(np.asarray(rPP) <= 0.0, (nface, ngas))
+    if absent.any():
+        theta = np.zeros((nface, ngas))
+        theta_vac = np.ones(nface)
+        converged = np.ones(nface, dtype=bool)
+        T_rows = np.broadcast_to(np.reshape(T, (-1, 1)), (nface, 1))
+        for mask in np.unique(absent, axis=0):
+            rows = np.flatnonzero((absent == mask).all(axis=1))
+            gases = np.flatnonzero(~mask)
+            if not gases.size:
+                continue
+
+            def sub(a):
+                # rows and present gases of a value given per gas or per face and gas
+                return np.broadcast_to(a, (nface, ngas))[rows][:, gases]
+            sub_guess = None
+            if guess is not None:
+                sub_guess = (sub(guess[0]), np.broadcast_to(guess[1], (nface,))[rows])
+            theta_sub, theta_vac[rows], converged[rows] = solve_coverage(
+                T_rows[rows], E_ads[rows][:, gases], S_ads[rows][:, gases],
+                w[rows][:, gases][:, :, gases], sub(S_gas), sub(rPP), sub(dissociative),
+                tol, max_iter, steps, restarts, seed, sub_guess)
+            theta[np.ix_(rows, gases)] = theta_sub
+        return theta, theta_vac, converged
+    kT = k_b * np.reshape(T, (-1, 1))
+    n = np.where(dissociative, 2.0, 1.0)
+    with np.errstate(divide='ignore'):
+        ln_g0 = E_ads / kT - (S_ads - S_gas) / (n * k_b) - np.log(rPP) / n
+    w_kT = w / kT[..., None]
+    # Langmuir coverage, exact without lateral interactions
+    langmuir = np.concatenate((-ln_g0, np.zeros((nface, 1))), axis=1)
+    langmuir -= np.logaddexp.reduce(langmuir, axis=1)[:, None]
+    if guess is None:
+        y, converged = coverage_newton(langmuir.copy(), ln_g0, w_kT, tol, max_iter)
+    else:
+        with np.errstate(divide='ignore'):
+            y = np.log(np.concatenate((guess[0], np.reshape(guess[1], (-1, 1))), axis=1))
+        y, converged = coverage_newton(y, ln_g0, w_kT, tol, max_iter)
+        failed = np.flatnonzero(~converged)
+        if failed.size:
+            y_new, ok = coverage_newton(langmuir[failed], ln_g0[failed], w_kT[failed], tol, max_iter)
+            y[failed] = y_new
+            converged[failed] = ok
+
+    failed = np.flatnonzero(~converged)
+    if failed.size and steps:
+        y_path = langmuir[failed]
+        for lam in np.linspace(0.0, 1.0, steps + 1)[1:]:
+            y_path, ok = coverage_newton(y_path, ln_g0[failed], lam * w_kT[failed], tol, max_iter)
+        y[failed[ok]] = y_path[ok]
+        converged[failed[ok]] = True
+
+    rng = np.random.default_rng(seed)
+    for _ in range(restarts):
+        failed = np.flatnonzero(~converged)
+        if not failed.size:
+            break
+        y_rand = np.log(rng.dirichlet(np.ones(ngas + 1), failed.size))
+        y_rand, ok = coverage_newton(y_rand, ln_g0[failed], w_kT[failed], tol, max_iter)
+        y[failed[ok]] = y_rand[ok]
+        converged[failed[ok]] = True
+    theta = np.exp(y)
+    return theta[:, :ngas], theta[:, ngas], converged
+
+
+class CoverageTable:
+    '''
+    coverage of each face on a grid of temperatures and ln(pressures) for
+    the gases and faces of a Wulff object, answered by bilinear
+    interpolation
+    the error of each grid cell is the largest difference between the
+    interpolation and the exact coverage at its center and at the middle
+    of its edges times COVERAGE_TABLE_SAFETY, an estimate rather than a
+    strict bound
+    '''
+    def __init__(self, wulff, T_range, P_range, nT=COVERAGE_TABLE_SIZE, nP=COVERAGE_TABLE_SIZE):
+        self.key = CoverageTable.params_key(wulff)
+        self.params = (wulff.E_ads, wulff.S_ads, wulff.w, wulff.S_gas0, wulff.pp,
+                       wulff.ads_type == "Dissociative", wulff.coverage_seed)
+        self.T = np.linspace(T_range[0], T_range[1], nT)
+        self.lnP = np.linspace(np.log(P_range[0]), np.log(P_range[1]), nP)
+        T, lnP = np.meshgrid(self.T, self.lnP, indexing='ij')
+        self.theta, self.vacancy, converged = self.solve(T.ravel(), lnP.ravel())
+        shape = (nT, nP) + self.theta.shape[1:]
+        self.theta = self.theta.reshape(shape)
+        self.vacancy = self.vacancy.reshape(shape[:3])
+        converged = converged.reshape(shape[:3]).all(axis=2)
+
+        # error of the interpolation at the center and at the middle of the
+        # edges of each cell, where the quadratic terms along T and ln(P)
+        # are largest whatever their signs
+        T_c = (self.T[:-1] + self.T[1:]) / 2.0
+        lnP_c = (self.lnP[:-1] + self.lnP[1:]) / 2.0
+        points = [np.meshgrid(T_c, lnP_c, indexing='ij'),
+                  np.meshgrid(T_c, self.lnP, indexing='ij'),
+                  np.meshgrid(self.T, lnP_c, indexing='ij')]
+        sizes = [p[0].size for p in points]
+        theta_m, _, converged_m = self.solve(np.concatenate([p[0].ravel() for p in points]),
+                                             np.concatenate([p[1].ravel() for p in points]))
+        converged_m = converged_m.all(axis=1)
+        bounds = np.cumsum([0] + sizes)
+        center, T_edge, P_edge = [
+            (np.abs(theta_m[a:b].reshape(p[0].shape + shape[2:]) - exact).max(axis=(2, 3)),
+             converged_m[a:b].reshape(p[0].shape))
+            for p, a, b, exact in zip(
+                points, bounds[:-1], bounds[1:],
+                ((self.theta[:-1, :-1] + self.theta[1:, :-1] + self.theta[:-1, 1:] + self.theta[1:, 1:]) / 4.0,
+                 (self.theta[:-1] + self.theta[1:]) / 2.0,
+                 (self.theta[:, :-1] + self.theta[:, 1:]) / 2.0))]
+        # the samples miss higher order terms, hence the safety factor
+        self.error = COVERAGE_TABLE_SAFETY * np.maximum.reduce(
+            [center[0], T_edge[0][:, :-1], T_edge[0][:, 1:], P_edge[0][:-1], P_edge[0][1:]])
+        valid = (converged[:-1, :-1] & converged[1:, :-1] & converged[:-1, 1:] & converged[1:, 1:] &
+                 center[1] & T_edge[1][:, :-1] & T_edge[1][:, 1:] & P_edge[1][:-1] & P_edge[1][1:])
+        self.error[~valid] = np.inf
+
+    @staticmethod
+    def params_key(wulff):
+        # parameters the coverage depends on besides T and P
+        return (wulff.E_ads.tobytes(), wulff.S_ads.tobytes(), wulff.w.tobytes(),
+                wulff.S_gas0.tobytes(), wulff.pp.tobytes(), tuple(wulff.ads_type))
+
+    def solve(self, T, lnP):
+        # exact coverage at the points (T, lnP), all faces and points at once
+        E_ads, S_ads, w, S_gas0, pp, dissociative, seed = self.params
+        npts, nface = T.shape[0], E_ads.shape[0]
+        rPP = pp * np.exp(lnP)[:, None] / 100.0
+        with np.errstate(divide='ignore'):
+            S_gas = S_gas0 - k_b * np.log(rPP / P0)
+        theta, vacancy, converged = solve_coverage(
+            np.repeat(T, nface), np.tile(E_ads, (npts, 1)), np.tile(S_ads, (npts, 1)),
+            np.tile(w, (npts, 1, 1)), np.repeat(S_gas, nface, axis=0),
+            np.repeat(rPP, nface, axis=0), dissociative, seed=seed)
+        return (theta.reshape(npts, nface, -1), vacancy.reshape(npts, nface),
+                converged.reshape(npts, nface))
+
+    def interpolate(self, T, P):
+        '''
+        coverage, vacancies and error estimate at (T, P), None outside the table
+        '''
+        if P <= 0.0:
+            return None
+        lnP = np.log(P)
+        if not (self.T[0] <= T <= self.T[-1] and self.lnP[0] <= lnP <= self.lnP[-1]):
+            return None
+        i = min(np.searchsorted(self.T, T, side='right') - 1, self.T.shape[0] - 2)
+        j = min(np.searchsorted(self.lnP, lnP, side='right') - 1, self.lnP.shape[0] - 2)
+        u = (T - self.T[i]) / (self.T[i + 1] - self.T[i])
+        v = (lnP - self.lnP[j]) / (self.lnP[j + 1] - self.lnP[j])
+        weights = ((1 - u) * (1 - v), u * (1 - v), (1 - u) * v, u * v)
+        cells = ((i, j), (i + 1, j), (i, j + 1), (i + 1, j + 1))
+        theta = sum(wt * self.theta[c] for wt, c in zip(weights, cells))
+        vacancy = sum(wt * self.vacancy[c] for wt, c in zip(weights, cells))
+        return theta, vacancy, self.error[i, j]
+
+
 class Wulff:
     def __init__(self) -> None:
         self.ele = ''
@@ -217,6 +822,8 @@ class Wulff:
         self.d = 0.0  # radius of nanoparticle
 
         self.nGas = 3
+        self.pp = np.array([])  # percentage of each gas in the pressure
+        self.S_gas0 = np.array([])  # entropy of each gas at P0
         self.rPP = np.array([])  # partial pressure
         self.S_gas = np.array([[]])  # factors to compute adsorption entropy (of each gas)
         self.ads_type = np.array([[]])  # adsorption type of each gas
@@ -231,12 +838,102 @@ class Wulff:
 
         self.coverage = np.array([])  # coverage of each face
         self.revised_gamma = np.array([])  # revised gamma of each face
+        self.coverage_converged = np.array([], dtype=bool)  # convergence of the coverage of each face
+        self.coverage_seed = 0  # seed of the random restarts of the coverage solver
+        self.coverage_state = None  # unbounded coverage and vacancies of the last solve
+        self.coverage_table = None  # CoverageTable answering gen_coverage by interpolation
+        self.coverage_tol = 1e-3  # largest interpolation error accepted, exact solve above
+        self.coverage_error = 0.0  # error estimate of the coverage, 0 if solved exactly
         self.bond_length = 3.0
 
+        self.bound_lattice = True  # only generate lattice inside the circumscribed sphere
+        self.int_lattice = False  # carve FCC/BCC on the integer lattice
+        self.sym_carve = False  # carve FCC/BCC from the wedge of m-3m, on a box centered on an atom
+        self.chunk_size = CHUNK_SIZE  # number of atoms carved at a time
+        self.nBulk = 0  # number of lattice atoms generated
+
         self.positions = np.array([])
         self.eles = np.array([])
         self.nAtoms = 0
-        self.siteTypes = np.array([])
+        self.siteCodes = np.array([], dtype=np.int8)  # site type of each atom, index of siteTable
+        self.siteTable = np.array([])  # label of each site type
+        self.siteColors = np.array([])  # element used to color each site type
+        self.graph = None  # NeighborGraph of the nanoparticle, rebuilt on first use after a cache hit
+        self.write_files = True  # write the xyz files and faceinfo.txt in data/
+        self.use_cache = True  # load the results of run from result_cache, False to bypass it
+        self.profile_memory = False  # trace peak memory of each stage (tracemalloc slows down python loops)
+        self.stage_stats = {}  # wall time, peak memory and array sizes of each stage
+
+    @property
+    def graph(self):
+        # a run loaded from result_cache has no graph until it is asked for
+        if self._graph is None and len(self.positions):
+            self._graph = NeighborGraph(self.positions, self.bond_length)
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+
+    @property
+    def siteTypes(self):
+        # label of each atom
+        return self.siteTable[self.siteCodes] if self.siteTable.size else np.array([])
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        record wall time (s) and peak memory (bytes) of the code run inside
+        in stage_stats[name], array sizes can be added as record['sizes']
+        '''
+        record = {'sizes': {}, 'memory_note': None}
+        started = self.profile_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        traced = self.profile_memory
+        if not self.profile_memory:
+            record['memory_note'] = 'off'
+        elif hasattr(tracemalloc, 'reset_peak'):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        elif started:
+            # python 3.8 has no reset_peak, clearing our own traces also resets the peak
+            tracemalloc.clear_traces()
+            base = 0
+        else:
+            # tracing started by someone else, whose traces must not be cleared
+            traced = False
+            record['memory_note'] = 'needs python 3.9'
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter() - start
+            record['traced'] = traced
+            record['peak_memory'] = None
+            if traced:
+                record['peak_memory'] = tracemalloc.get_traced_memory()[1] - base
+            if started:
+                tracemalloc.stop()
+            self.stage_stats[name] = record
+
+    def stage_report(self):
+        '''
+        table of stage_stats for the log
+        '''
+        time_label = 'time (s)'
+        if any(record.get('traced') for record in self.stage_stats.values()):
+            # tracemalloc hooks every allocation, python loops run several times slower
+            time_label = 'time (s, traced)'
+        report = pd.DataFrame(columns=[time_label, 'peak memory (MB)', 'sizes'])
+        for name, record in self.stage_stats.items():
+            if record['peak_memory'] is None:
+                memory = record.get('memory_note') or '/'
+            else:
+                memory = '%.2f' % (record['peak_memory'] / 1024**2)
+            sizes = ', '.join(f"{key}: {value}" for key, value in record['sizes'].items())
+            report.loc[name] = ['%.4f' % record['time'], memory, sizes]
+        return report
 
     def get_para(self, paradic):
         gas_flag = [1, 1, 1]
@@ -244,6 +941,9 @@ class Wulff:
         self.structure = paradic["Crystal structure"]
         try:
             self.latt_para_a = float(paradic["Lattice constant"])
+            # c of HCP lattice, fall back to the ideal c/a ratio
+            self.latt_para_c = float(paradic.get("Lattice constant c",
+                                                 np.sqrt(8.0 / 3.0) * self.latt_para_a))
             self.P = float(paradic["Pressure"])
             self.T = float(paradic["Temperature"])
         except ValueError:
@@ -262,9 +962,12 @@ class Wulff:
                 self.nGas -= 1
             else:
                 PP = float(PP_l[i])
+                self.pp = np.append(self.pp, PP)
+                self.S_gas0 = np.append(self.S_gas0, float(S_l[i]))
                 rPP = PP * self.P / 100.0
                 self.rPP = np.append(self.rPP, rPP)
-                S = float(S_l[i]) - k_b*np.log(rPP/P0)
+                with np.errstate(divide='ignore'):
+                    S = float(S_l[i]) - k_b*np.log(rPP/P0)
                 self.S_gas = np.append(self.S_gas, S)
                 self.ads_type = np.append(self.ads_type, type_l[i])
 
@@ -279,11 +982,11 @@ class Wulff:
             facedic = paradic[f"Face{m+1}"]
             face = facedic["index"]
             self.face_index = np.append(self.face_index, face)
-            index = [int(s) for s in re.findall(r"-*[0-9]", face)]
-            if len(index) != 3:
+            try:
+                h, k, l = parse_index(face, self.structure)
+            except ValueError:
                 message = f"Please check the face index of face{m+1}"
                 return False, message
-            h, k, l = index[0], index[1], index[2]
             # calculate areas
             if self.structure == 'FCC':
                 self.bond_length = 1.45/2*self.latt_para_a
@@ -332,201 +1035,493 @@ class Wulff:
                     x += 1
         return True, ""
 
-    def gen_coverage(self):
+    def set_conditions(self, T, P, composition=None):
+        '''
+        change temperature, pressure and the percentage of each gas
+        (composition, same order as the gases of the input)
+        '''
+        if composition is not None and len(composition) != self.nGas:
+            raise ValueError(f"composition gives {len(composition)} gases, the input has {self.nGas}")
+        self.T = float(T)
+        self.P = float(P)
+        if composition is not None:
+            self.pp = np.array(composition, dtype=float)
+        self.rPP = self.pp * self.P / 100.0
+        with np.errstate(divide='ignore'):
+            self.S_gas = self.S_gas0 - k_b * np.log(self.rPP / P0)
+
+    def gen_coverage(self, warm_start=False):
         # generate coverage based on
-        self.coverage = np.zeros((self.face_num, self.nGas))
-        if self.P == 0.0:
-            return self.coverage
-        for m in range(self.face_num):
-            # solve coverage
-            theta = np.array([])
-
-            def func(TTT):
-                TT = np.zeros((self.nGas))
-                f = np.zeros((self.nGas + 1))
-                for k in range(self.nGas):
-                    TT[k] = TTT[k]
-                # calculate w
-                cal_w = np.mat(self.w[m]) * np.mat(TT).T
-                cal_w = cal_w.getA().flatten()
-                for k in range(self.nGas):
-                    if (self.ads_type[k] == "Associative"):
-                        f[k] = TTT[k] * np.exp(
-                            (self.E_ads[m, k] - cal_w[k] - self.T * (self.S_ads[m, k] - self.S_gas[k])) /
-                            (k_b * self.T)) / self.rPP[k] - TTT[-1]
-                    elif (self.ads_type[k] == "Dissociative"):
-                        f[k] = TTT[k] * (np.exp(
-                            (2 * self.E_ads[m, k] - 2 * cal_w[k] - self.T * (self.S_ads[m, k] - self.S_gas[k]))
-                            / (k_b * self.T)) / self.rPP[k])**0.5 - TTT[-1]
-                f[-1] = np.sum(TTT) - 1
-                return f
-
-            # iteration and check solution
-            while True:
-                theta = fsolve(func, np.random.rand(self.nGas + 1))
-                if (theta > 0).all() and abs(np.sum(func(theta))) < 10**(-6):
-                    break
-            # finding indices where theta >= self.thetaML[m]
+        # warm_start: start from the last solution (coverage_state)
+        with self.stage('gen_coverage') as record:
+            record['sizes'] = {'faces': self.face_num, 'gases': self.nGas}
+            self.coverage = np.zeros((self.face_num, self.nGas))
+            self.coverage_converged = np.ones(self.face_num, dtype=bool)
+            if self.P == 0.0:
+                self.coverage_state = None
+                return 1, ""
+            answer = None
+            if self.coverage_table is not None and self.coverage_table.key == CoverageTable.params_key(self):
+                answer = self.coverage_table.interpolate(self.T, self.P)
+            if answer is not None and answer[2] <= self.coverage_tol:
+                theta, theta_vac, self.coverage_error = answer
+            else:
+                guess = self.coverage_state if warm_start else None
+                theta, theta_vac, self.coverage_converged = solve_coverage(
+                    self.T, self.E_ads, self.S_ads, self.w, self.S_gas, self.rPP,
+                    self.ads_type == "Dissociative", seed=self.coverage_seed, guess=guess)
+                self.coverage_error = 0.0
+            self.coverage_state = (theta.copy(), theta_vac)
+            # finding faces where theta >= self.thetaML
             for j in range(self.nGas):
-                if theta[j] >= self.thetaML[m]:
-                    theta = np.zeros((self.nGas))
-                    theta[j] = self.thetaML[m]
-            for k in range(self.nGas):
-                self.coverage[m][k] = theta[k]
+                full = theta[:, j] >= self.thetaML
+                theta[full] = 0.0
+                theta[full, j] = self.thetaML[full]
+            self.coverage[:] = theta
+        if not self.coverage_converged.all():
+            faces = ', '.join(self.face_index[~self.coverage_converged])
+            message = f"Coverage not converged on face {faces}"
+            return 0, message
+        return 1, ""
+
+    def build_coverage_table(self, T_range, P_range, nT=COVERAGE_TABLE_SIZE, nP=COVERAGE_TABLE_SIZE):
+        '''
+        tabulate the coverage over T_range (K) and P_range (Pa) for the
+        current gases and faces, gen_coverage then interpolates in the table
+        where its error is below coverage_tol
+        '''
+        with self.stage('coverage_table') as record:
+            self.coverage_table = CoverageTable(self, T_range, P_range, nT, nP)
+            record['sizes'] = {'points': nT * nP, 'faces': self.face_num}
+        return self.coverage_table
+
+    def size_series(self, radii):
+        '''
+        nanoparticles of each radius of radii under the same conditions,
+        the same as running geometry for each radius
+        surface energy ratios do not depend on the radius, so the largest
+        particle of each parity of lattice replicas (which keeps the lattice
+        center) is carved once and the smaller ones are thresholded from its
+        plane distances, with their neighbors taken from its graph
+        the particles do not write the files of data/, call write_output
+        of the one to keep
+        with sym_carve, each radius is carved on its own box centered on an atom
+        return (1, list of Wulff objects, one per radius) or (0, message)
+        '''
+        if self.sym_carve and self.structure in ('FCC', 'BCC'):
+            particles = []
+            for d in radii:
+                particle = copy.copy(self)
+                particle.d = d
+                particle.stage_stats = {}
+                particle.write_files = False
+                flag, message = particle.geometry()
+                if not flag:
+                    return 0, message
+                particles.append(particle)
+            return 1, particles
+        with self.stage('gen_surface_energies') as record:
+            planes, surface_energies = self.gen_surface_energies()
+            record['sizes'] = {'planes': len(planes)}
+        if sum(self.revised_gamma > 0) != self.face_num:
+            message = "Nanoparticle broken \n\nNegative surface energy "
+            return 0, message
+        prim_block, cell, transform = lattice_params(self.structure, self.latt_para_a, self.latt_para_c)
+        lengths, reps = [], []
+        for d in radii:
+            length = np.array([e * d / np.min(surface_energies) for e in surface_energies])
+            lengths.append(length)
+            reps.append(np.array([int(np.min(length) * 3 / c) for c in cell]))
+        groups = {}
+        for n, rep in enumerate(reps):
+            groups.setdefault(tuple(rep % 2), []).append(n)
+
+        particles = [None] * len(radii)
+        for group in groups.values():
+            largest = max(group, key=lambda n: radii[n])
+            radius = None
+            if self.bound_lattice:
+                radius = circumradius(planes, lengths[largest])
+                if radius is not None:
+                    radius += 1e-6
+            with self.stage('lattice') as record:
+                bulk = lattice_cache.get(self.structure, np.min(lengths[largest]) * 3,
+                                         self.latt_para_a, self.latt_para_c, radius)
+                record['sizes'] = {'atoms': bulk.shape[0]}
+            with self.stage('gen_cluster') as record:
+                distance, valid_atoms = gen_cluster(bulk, planes, lengths[largest],
+                                                    radii[largest], self.chunk_size)
+                coor_valid = bulk[valid_atoms]
+                graph = NeighborGraph(coor_valid, self.bond_length)
+                record['sizes'] = {'atoms': coor_valid.shape[0], 'planes': len(planes)}
+            # replica of each lattice atom, to crop the box of smaller radii
+            cell_index = lattice_cells(bulk, prim_block, cell, transform, reps[largest])
+            r2 = np.sum(bulk**2, axis=1)
+            for n in group:
+                shift = (reps[largest] - reps[n]) // 2
+                in_box = ((cell_index >= shift) & (cell_index < shift + reps[n])).all(axis=1)
+                if self.bound_lattice:
+                    radius = circumradius(planes, lengths[n])
+                    if radius is not None:
+                        in_box &= r2 <= (radius + 1e-6)**2
+                keep = in_box[valid_atoms] & (np.sum(distance > lengths[n], axis=1) == 0)
+                keep = np.flatnonzero(keep)
+                particle = copy.copy(self)
+                particle.d = radii[n]
+                particle.stage_stats = {}
+                # the files of data/ are named by T and P only, each radius would overwrite them
+                particle.write_files = False
+                particle.nBulk = int(np.count_nonzero(in_box))
+                subgraph = graph.subgraph(keep)
+                particle.build_particle(subgraph.coors, planes, distance[keep], subgraph)
+                particles[n] = particle
+        return 1, particles
+
+    def coverage_path(self, conditions):
+        '''
+        coverage along a path of (T, P) or (T, P, composition) points, each
+        solve starts from the solution at the previous point
+        returns coverages (points x faces x gases) and converged flags
+        (points x faces), the conditions of the last point are kept
+        '''
+        coverages = np.zeros((len(conditions), self.face_num, self.nGas))
+        converged = np.zeros((len(conditions), self.face_num), dtype=bool)
+        for i, condition in enumerate(conditions):
+            self.set_conditions(*condition)
+            self.gen_coverage(warm_start=i > 0)
+            coverages[i] = self.coverage
+            converged[i] = self.coverage_converged
+        return coverages, converged
+
+    def c_over_a(self):
+        # c/a of HCP, None for cubic structures
+        return self.latt_para_c / self.latt_para_a if self.structure == 'HCP' else None
 
     def gen_surface_energies(self):
-        planes, surface_energies = [], []
-        self.revised_gamma = np.zeros((self.face_num))
-        self.planes_dict = {}
+        # surface energies revised by the adsorbates, for all faces at once
+        cal_w = np.einsum('mij,mj->mi', self.w, self.coverage)
+        r_ads = (self.E_ads - cal_w) / self.A_atoms[:, None]
+        self.revised_gamma = self.gamma + np.einsum('mi,mi->m', self.coverage, r_ads)
 
-        for m in range(self.face_num):
-            r_gamma = 0.0
-            r_ads = np.zeros((self.nGas))
-            cal_w = np.mat(self.w[m]) * np.mat(self.coverage[m]).T
-            cal_w = cal_w.getA().flatten()
-            r_ads = (self.E_ads[m] - cal_w) / self.A_atoms[m]
-            r_gamma = np.mat(self.coverage[m]) * np.mat(r_ads).T
-            self.revised_gamma[m] = float(self.gamma[m] + r_gamma)
-
-            plane = get_planes(self.face_index[m], self.structure)
-            for p in plane:
-                self.planes_dict[p] = self.face_index[m]
+        planes = []
+        self.planes_dict = {}
+        counts = []
+        for face in self.face_index:
+            normals = plane_normals(face, self.structure, self.c_over_a())
+            plane = [tuple(p) for p in normals.tolist()]
+            self.planes_dict.update(dict.fromkeys(plane, face))
             planes += plane
-            surface_energies += [self.revised_gamma[m]] * len(plane)
+            counts.append(len(plane))
+        surface_energies = np.repeat(self.revised_gamma, counts).tolist()
         return (planes, surface_energies)
 
-    def mark_atoms(self, cn, valid_atoms, planes, distance):
-        distance = distance[valid_atoms, :]
+    def mark_atoms(self, cn, planes, distance):
+        # distance: distance of the kept atoms to each plane
+        # site types are returned as int8 codes into a table of labels and
+        # coloring elements (SITE_TYPES first, then the faces)
+        natoms = distance.shape[0]
+        # integer facet ID of each face (first entry of face_index) and plane
+        face_ids = {}
+        for m, face in enumerate(self.face_index):
+            face_ids.setdefault(face, m)
+        faces = [self.planes_dict[p] for p in planes]
+        plane_face = np.array([face_ids[face] for face in faces], dtype=int)
+        face_of = np.array([face_ids[face] for face in self.face_index], dtype=int)
+        site_table = list(SITE_TYPES)
+        site_colors = list(SITE_COLORS)
+        face_code = np.zeros(self.face_num, dtype=int)
+        for face, m in face_ids.items():
+            face_code[m] = len(site_table)
+            site_table.append(f"{face} ")
+            site_colors.append(FACE_COLORS.get(face, 'Rh'))
+
+        # atoms close to the outermost layer of each plane
         max_d = np.max(distance, axis=0)
-        surf_type = np.array([])
-        color_ele = np.array([])
-        n_surfs = np.zeros(self.face_num)
-        ratio_edges = np.zeros(self.face_num)
-        ratio_corners = np.zeros(self.face_num)
-        edge_corner_list = np.array([], dtype=int)
-        nedges = 0
-        ncorners = 0
-        for n in range(len(valid_atoms)):
-            count = 0
-            surf_type = np.append(surf_type, '')
-            color_ele = np.append(color_ele, 'O')
-            if (self.structure=='FCC' and cn[n]<10) or (self.structure=='BCC' and cn[n]<7):
-                for m, plane in enumerate(planes):
-                    face = self.planes_dict[plane]
-                    if distance[n, m] >= max_d[m] - 0.45*self.face_d[face]:
-                        p = face
-                        surf_type[n] += f"{p} "
-                        count += 1
-                if count == 1:
-                    n_surfs[np.argwhere(self.face_index==p)] += 1
-                    if p == '100':
-                        color_ele[n] = 'Au'
-                    elif p == '110':
-                        color_ele[n] = 'Cu'
-                    elif p == '111':
-                        color_ele[n] = 'Fe'
-                    else:
-                        color_ele[n] = 'Rh'
-                elif count >= 2:
-                    edge_corner_list = np.append(edge_corner_list, n)
-                else:
-                    surf_type[n] = 'subsurface'   
-            else:
-                surf_type[n] = ' bulk'
-                color_ele[n] = 'Co'
-        for n in edge_corner_list:
-            surf_type_a = np.array(surf_type[n].split(), dtype=str)
-            for m, face_id in enumerate(self.face_index):
-                if n_surfs[m] == 0:
-                    surf_type_a = surf_type_a[surf_type_a != face_id]
-            l = len(surf_type_a)
-            if l == 1:
-                p = surf_type_a[0]
-                n_surfs[np.argwhere(self.face_index==p)] += 1
-                if p == '100':
-                    color_ele[n] = 'Au'
-                elif p == '110':
-                    color_ele[n] = 'Cu'
-                elif p == '111':
-                    color_ele[n] = 'Fe'
-                else:
-                    color_ele[n] = 'Rh'
-            elif l == 2:
-                surf_type[n] = 'edge'
-                nedges += 1
-                ratio_edges[np.argwhere(self.face_index==surf_type_a[0])] += 0.5
-                ratio_edges[np.argwhere(self.face_index==surf_type_a[1])] += 0.5
-                color_ele[n] = 'Pt'
-            elif l >= 3:
-                surf_type[n] = 'corner'
-                ncorners += 1
-                r = 1.0/l
-                for face in surf_type_a:
-                    ratio_corners[np.argwhere(self.face_index==face)] += r
-                color_ele[n] = 'Pd'
-            else: 
-                surf_type[n] = 'unkonwn'
-        return (surf_type, color_ele, n_surfs, ratio_edges, ratio_corners, ncorners, nedges)
+        face_d = np.array([self.face_d[face] for face in faces])
+        near = distance >= max_d - 0.45 * face_d
+        if self.structure in ('FCC', 'HCP'):
+            surface = cn < 10
+        elif self.structure == 'BCC':
+            surface = cn < 7
+        else:
+            surface = np.zeros(natoms, dtype=bool)
+        count = np.where(surface, np.sum(near, axis=1), 0)
 
-    def geometry(self):
+        site_code = np.where(surface, SITE_SUBSURFACE, SITE_BULK)
+        # atoms on a single plane
+        single = np.flatnonzero(surface & (count == 1))
+        single_face = plane_face[np.argmax(near[single], axis=1)]
+        site_code[single] = face_code[single_face]
+        n_surfs = np.bincount(single_face, minlength=self.face_num)[face_of].astype(float)
+
+        # atoms on several planes: only facets that hold single-plane atoms
+        # count, labels were kept in 32 characters
+        multi = np.flatnonzero(surface & (count >= 2))
+        on_plane = near[multi]
+        token_len = np.array([len(face) + 1 for face in faces])
+        token_end = np.cumsum(on_plane * token_len, axis=1)
+        token = on_plane & (token_end - 1 <= 32)
+        cut_token = np.any(on_plane & (token_end - token_len < 32) & (token_end - 1 > 32), axis=1)
+        token &= (n_surfs[plane_face] != 0)
+        n_tokens = np.sum(token, axis=1) + cut_token
+
+        # a single facet left: the atom keeps the label of all its planes
+        one = np.flatnonzero(n_tokens == 1)
+        one_face_id = plane_face[np.argmax(token[one], axis=1)]
+        labels = {}
+        for n, row, face_id, cut in zip(one, on_plane[one], one_face_id, cut_token[one]):
+            label = ''.join(f"{face} " for face, hit in zip(faces, row) if hit)[:32]
+            if label not in labels:
+                labels[label] = len(site_table)
+                site_table.append(label)
+                site_colors.append('Rh' if cut else site_colors[face_code[face_id]])
+            site_code[multi[n]] = labels[label]
+        one_face_id = one_face_id[~cut_token[one]]
+        n_surfs += np.bincount(one_face_id, minlength=self.face_num)[face_of]
+
+        edge = n_tokens == 2
+        site_code[multi[edge]] = SITE_EDGE
+        nedges = int(np.sum(edge))
+        rows, cols = np.nonzero(token[edge])
+        ratio_edges = np.bincount(plane_face[cols], weights=np.full(cols.shape[0], 0.5),
+                                  minlength=self.face_num)[face_of]
+
+        corner = n_tokens >= 3
+        site_code[multi[corner]] = SITE_CORNER
+        ncorners = int(np.sum(corner))
+        rows, cols = np.nonzero(token[corner])
+        ratio_corners = np.bincount(plane_face[cols], weights=1.0 / n_tokens[corner][rows],
+                                    minlength=self.face_num)[face_of]
+
+        site_code[multi[n_tokens == 0]] = SITE_UNKNOWN
+        site_code = site_code.astype(np.int8 if len(site_table) <= 128 else np.int16)
+        return (site_code, np.array(site_table), np.array(site_colors),
+                n_surfs, ratio_edges, ratio_corners, ncorners, nedges)
+
+    def prepass(self):
+        '''
+        Wulff polyhedron of the nanoparticle without building any atoms
+        return (1, shape) with the vertices, the area and area fraction of
+        each face, the volume and an estimate of the number of atoms,
+        or (0, message)
+        '''
         planes, surface_energies = self.gen_surface_energies()
+        if sum(self.revised_gamma > 0) != self.face_num:
+            message = "Nanoparticle broken \n\nNegative surface energy "
+            return 0, message
+        length = np.array([e * self.d / np.min(surface_energies) for e in surface_energies])
+        shape = wulff_shape(planes, length)
+        if shape is None:
+            message = "Nanoparticle broken \n\nFaces do not enclose a polyhedron "
+            return 0, message
+        vertices, plane_areas, volume = shape
+        areas = np.zeros(self.face_num)
+        for plane, area in zip(planes, plane_areas):
+            areas[self.face_index == self.planes_dict[plane]] += area
+        if self.structure == 'FCC':
+            atom_volume = self.latt_para_a**3 / 4.0
+        elif self.structure == 'BCC':
+            atom_volume = self.latt_para_a**3 / 2.0
+        else:
+            atom_volume = np.sqrt(3.0) / 4.0 * self.latt_para_a**2 * self.latt_para_c
+        return 1, {'vertices': vertices,
+                   'areas': areas,
+                   'fractions': areas / np.sum(areas),
+                   'volume': volume,
+                   'nAtoms': int(round(volume / atom_volume))}
+
+    def cache_params(self):
+        '''
+        inputs the results of run depend on, in a normalized form (parsed
+        numbers, unused gases dropped) for the key of result_cache
+        '''
+        table = None
+        if self.coverage_table is not None and self.coverage_table.key == CoverageTable.params_key(self):
+            table = [self.coverage_table.T.tolist(), self.coverage_table.lnP.tolist()]
+        return {
+            'element': self.ele, 'structure': self.structure,
+            'a': float(self.latt_para_a), 'c': float(self.latt_para_c),
+            'T': float(self.T), 'P': float(self.P), 'd': float(self.d),
+            'pp': self.pp.tolist(), 'S_gas': self.S_gas0.tolist(), 'ads_type': self.ads_type.tolist(),
+            'faces': self.face_index.tolist(), 'gamma': self.gamma.tolist(),
+            'E_ads': self.E_ads.tolist(), 'S_ads': self.S_ads.tolist(), 'w': self.w.tolist(),
+            'thetaML': self.thetaML.tolist(), 'coverage_seed': self.coverage_seed,
+            'coverage_table': table, 'coverage_tol': self.coverage_tol,
+            'int_lattice': self.int_lattice, 'sym_carve': self.sym_carve,
+        }
+
+    def run(self):
+        '''
+        gen_coverage and geometry, the results are loaded from result_cache
+        if the same inputs were run before (unless use_cache is False) and
+        saved there otherwise
+        '''
+        key = None
+        if self.use_cache:
+            with self.stage('load_cache') as record:
+                key = result_cache.key(self.cache_params())
+                arrays = result_cache.load(key)
+                record['sizes'] = {'hit': int(arrays is not None)}
+            if arrays is not None:
+                self.set_result(arrays)
+                if self.write_files:
+                    with self.stage('output') as record:
+                        self.write_output()
+                        record['sizes'] = {'atoms': int(self.nAtoms)}
+                return 1, ""
+        flag, message = self.gen_coverage()
+        if flag:
+            flag, message = self.geometry()
+        if flag and key is not None:
+            with self.stage('save_cache') as record:
+                saved = result_cache.save(key, self.get_result())
+                record['sizes'] = {'atoms': int(self.nAtoms), 'saved': int(saved)}
+        return flag, message
+
+    def get_result(self):
+        # arrays of the results of run, saved by result_cache
+        theta, theta_vac = self.coverage_state if self.coverage_state is not None else (None, None)
+        arrays = {
+            'positions': self.positions, 'siteCodes': self.siteCodes,
+            'siteTable': self.siteTable, 'siteColors': self.siteColors,
+            'coverage': self.coverage, 'coverage_converged': self.coverage_converged,
+            'coverage_error': np.array(self.coverage_error), 'revised_gamma': self.revised_gamma,
+            'nBulk': np.array(self.nBulk), 'record_df': np.array(self.record_df.to_json(orient='split')),
+        }
+        if theta is not None:
+            arrays['theta'], arrays['theta_vac'] = theta, theta_vac
+        return arrays
+
+    def set_result(self, arrays):
+        # restore the results of run from get_result
+        self.positions = arrays['positions']
+        self.nAtoms = np.array(self.positions.shape[0])
+        self.eles = [self.ele for i in range(self.nAtoms)]
+        self.siteCodes = arrays['siteCodes']
+        self.siteTable = arrays['siteTable']
+        self.siteColors = arrays['siteColors']
+        self.coverage = arrays['coverage']
+        self.coverage_converged = arrays['coverage_converged']
+        self.coverage_error = float(arrays['coverage_error'])
+        self.coverage_state = None
+        if 'theta' in arrays:
+            self.coverage_state = (arrays['theta'], arrays['theta_vac'])
+        self.revised_gamma = arrays['revised_gamma']
+        self.nBulk = int(arrays['nBulk'])
+        self.record_df = pd.read_json(io.StringIO(str(arrays['record_df'])), orient='split',
+                                      dtype=False, convert_axes=False)
+        self.graph = None
+
+    def geometry(self):
+        with self.stage('gen_surface_energies') as record:
+            planes, surface_energies = self.gen_surface_energies()
+            record['sizes'] = {'planes': len(planes)}
         if sum(self.revised_gamma > 0) != self.face_num:
             message = "Nanoparticle broken \n\nNegative surface energy "
             return 0, message
         length = [e * self.d / np.min(surface_energies) for e in surface_energies]
         length = np.array(length)
         bulk_dim = np.min(length) * 3
-        if self.structure == 'FCC':
-            bulk = gen_fcc(bulk_dim, self.latt_para_a)
-        elif self.structure == 'BCC':
-            bulk = gen_bcc(bulk_dim, self.latt_para_a)
-        elif self.structure == 'HCP':
-            bulk = gen_hcp(bulk_dim, self.latt_para_a, self.latt_para_c)
-        distance, valid_atoms = gen_cluster(bulk, planes, length, self.d)
-        coor_valid = bulk[valid_atoms]
+        radius = None
+        if self.bound_lattice:
+            radius = circumradius(planes, length)
+            if radius is not None:
+                radius += 1e-6
+        int_lattice = self.int_lattice and self.structure in ('FCC', 'BCC')
+        sym_carve = self.sym_carve and self.structure in ('FCC', 'BCC')
+        if sym_carve:
+            wedge = symmetric_planes(planes, length, POINT_GROUPS[self.structure])
+        with self.stage('lattice') as record:
+            if sym_carve:
+                # the whole box when the planes do not have the symmetry of the lattice
+                bulk, unit = gen_cubic_int(self.structure, bulk_dim, self.latt_para_a, radius, wedge)
+            elif int_lattice:
+                bulk, unit = lattice_cache.get(self.structure, bulk_dim, self.latt_para_a,
+                                               radius=radius, integer=True)
+            else:
+                bulk = lattice_cache.get(self.structure, bulk_dim, self.latt_para_a,
+                                         self.latt_para_c, radius)
+            self.nBulk = bulk.shape[0]
+            record['sizes'] = {'atoms': self.nBulk}
+        with self.stage('gen_cluster') as record:
+            if sym_carve and wedge:
+                coor_valid, distance = gen_cluster_sym(bulk, unit, planes, length, self.structure)
+                coor_valid = coor_valid * unit
+            elif int_lattice or sym_carve:
+                distance, valid_atoms = gen_cluster_int(bulk, unit, planes, length)
+                coor_valid = bulk[valid_atoms] * unit
+            else:
+                distance, valid_atoms = gen_cluster(bulk, planes, length, self.d, self.chunk_size)
+                coor_valid = bulk[valid_atoms]
+            record['sizes'] = {'atoms': coor_valid.shape[0], 'planes': len(planes)}
+        return self.build_particle(coor_valid, planes, distance)
+
+    def build_particle(self, coor_valid, planes, distance, graph=None):
+        '''
+        neighbors, site types and faceinfo of the carved atoms coor_valid,
+        distance holds their distances to planes, graph their NeighborGraph
+        if already known
+        '''
         N_atom = coor_valid.shape[0]
-        cn, gcn, nsurf, surfcn = surf_count(coor_valid, self.bond_length, self.structure)
-        self.positions = np.array(coor_valid)
+        with self.stage('surf_count') as record:
+            self.graph = NeighborGraph(coor_valid, self.bond_length) if graph is None else graph
+            cn, gcn, nsurf, surfcn = surf_count(coor_valid, self.bond_length, self.structure, self.graph)
+            record['sizes'] = {'atoms': N_atom, 'bonds': self.graph.adjacency.nnz // 2}
+        self.positions = coor_valid  # shared with the graph, not copied
         self.nAtoms = np.array(N_atom)
         self.eles = [self.ele for i in range(self.nAtoms)]
-        surf_type, color_ele, n_surfs, ratio_edges, ratio_corners, ncorners, nedges = self.mark_atoms(cn, valid_atoms, planes, distance)
-        self.siteTypes = np.array(surf_type)
+        with self.stage('mark_atoms') as record:
+            (self.siteCodes, self.siteTable, self.siteColors, n_surfs,
+             ratio_edges, ratio_corners, ncorners, nedges) = self.mark_atoms(cn, planes, distance)
+            record['sizes'] = {'atoms': N_atom, 'site types': len(self.siteTable)}
+        with self.stage('output') as record:
+            record_df = pd.DataFrame(columns=self.face_index)
+            record_df.loc['number'] = n_surfs
+            # record_df.loc['n_edges'] = ratio_edges
+            # record_df.loc['n_corners'] = ratio_corners
+            # record_df.loc['Atom area'] = self.A_atoms
+            # record_df.loc['Surface tension'] = self.revised_gamma
+            for i in range(self.nGas):
+                record_df.loc[f'coverage{i+1}'] = self.coverage[:,i]
+            record_df = record_df.applymap(lambda x: '%.2f'%x)
+            # record_df.loc['n_edges'] = pd.to_numeric(record_df.loc['n_edges'])
+            # record_df.loc['n_corners'] = pd.to_numeric(record_df.loc['n_corners'])
+            record_df['edges'] = '/'
+            record_df['corners'] = '/'
+            record_df['subsurface'] = '/'
+            record_df.loc['number', 'edges'] = nedges
+            record_df.loc['number', 'corners'] = ncorners
+            record_df.loc['number', 'subsurface'] = nsurf-n_surfs.sum()-nedges-ncorners
+            record_df.loc['number'] = record_df.loc['number'].astype(float).astype(int)
+            self.record_df = record_df
+            if self.write_files:
+                self.write_output()
+            record['sizes'] = {'atoms': N_atom}
+        # return (self.face_index, self.coverage, self.gamma, self.revised_gamma)
+        return 1, ""
+
+    def write_output(self):
+        '''
+        write the nanoparticle to data/OUTPUT (xyz with site types and
+        faceinfo.txt) and data/INPUT/ini.xyz for the kmc module
+        '''
+        N_atom = int(self.nAtoms)
+        # python lists, indexing numpy arrays atom by atom is slow
+        coor_valid = self.positions.tolist()
+        surf_type = self.siteTable[self.siteCodes].tolist()
+        color_ele = self.siteColors[self.siteCodes].tolist()
         filename_xyz = f"data/OUTPUT/{self.ele}_{self.structure}_T_{self.T}_P_{self.P}_cluster.xyz"
         with open(filename_xyz, 'w') as fp_xyz:
             with open('data/INPUT/ini.xyz', 'w') as kmc_ini:
                 fp_xyz.write('%d\n' % (N_atom))
                 fp_xyz.write('cluster_%d_%d.xyz\n' % (self.T, self.P))
                 kmc_ini.write('%d\n\n' % (N_atom))
-                for i in range(N_atom):
-                    fp_xyz.write('%s  %.3f  %.3f  %.3f  %s\n' %
-                                 (color_ele[i], coor_valid[i][0], coor_valid[i][1],
-                                  coor_valid[i][2], surf_type[i]))
-                    kmc_ini.write('%s  %.3f  %.3f  %.3f\n' %
-                                  (self.eles[i], coor_valid[i][0], coor_valid[i][1],
-                                   coor_valid[i][2]))
-        record_df = pd.DataFrame(columns=self.face_index)
-        record_df.loc['number'] = n_surfs
-        # record_df.loc['n_edges'] = ratio_edges
-        # record_df.loc['n_corners'] = ratio_corners
-        # record_df.loc['Atom area'] = self.A_atoms
-        # record_df.loc['Surface tension'] = self.revised_gamma
-        for i in range(self.nGas):
-            record_df.loc[f'coverage{i+1}'] = self.coverage[:,i]
-        record_df = record_df.applymap(lambda x: '%.2f'%x)
-        # record_df.loc['n_edges'] = pd.to_numeric(record_df.loc['n_edges'])
-        # record_df.loc['n_corners'] = pd.to_numeric(record_df.loc['n_corners'])
-        record_df['edges'] = '/'
-        record_df['corners'] = '/'
-        record_df['subsurface'] = '/'
-        record_df.loc['number', 'edges'] = nedges
-        record_df.loc['number', 'corners'] = ncorners
-        record_df.loc['number', 'subsurface'] = nsurf-n_surfs.sum()-nedges-ncorners
-        record_df.loc['number'] = record_df.loc['number'].astype(float).astype(int)
-        self.record_df = record_df
+                fp_xyz.writelines('%s  %.3f  %.3f  %.3f  %s\n' % (color, x, y, z, label)
+                                  for color, (x, y, z), label in zip(color_ele, coor_valid, surf_type))
+                kmc_ini.writelines('%s  %.3f  %.3f  %.3f\n' % (ele, x, y, z)
+                                   for ele, (x, y, z) in zip(self.eles, coor_valid))
         with open('data/OUTPUT/faceinfo.txt', 'w') as fo:
-            fo.write(record_df.__repr__())
-        # return (self.face_index, self.coverage, self.gamma, self.revised_gamma)
-        return 1, ""
+            fo.write(self.record_df.__repr__())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Neighbor search for the MSR module
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+
+
+def wrap(coors, box, pbc):
+    '''
+    coors moved into the box along the periodic axes pbc, coors itself
+    (not a copy) if they are all inside already
+    '''
+    inside = (coors[..., pbc] >= 0.0) & (coors[..., pbc] < box[pbc])
+    if inside.all():
+        return coors
+    coors = coors.copy()
+    coors[..., pbc] %= box[pbc]
+    return coors
+
+
+def neighbor_pairs(coors, cutoff, box=None, pbc=None):
+    '''
+    pairs (i, j) with i < j of atoms closer than cutoff, found with a
+    KD-tree in O(N log N)
+    box: lengths of an orthorhombic cell, pbc: periodic axes (all axes
+    if box is given and pbc is None); periodic distances follow the
+    minimum image convention, which needs cutoff < box / 2
+    '''
+    coors = np.asarray(coors, dtype=float)
+    if box is None:
+        pairs = cKDTree(coors).query_pairs(cutoff, output_type='ndarray')
+        # the tree keeps pairs at distance <= cutoff, the distance test is strict
+        dist = np.sqrt(np.sum((coors[pairs[:, 0]] - coors[pairs[:, 1]]) ** 2, axis=1))
+        return pairs[dist < cutoff]
+
+    box = np.asarray(box, dtype=float)
+    pbc = np.ones(3, dtype=bool) if pbc is None else np.asarray(pbc, dtype=bool)
+    if (cutoff >= box[pbc] / 2).any():
+        raise ValueError("cutoff must be smaller than half of the periodic box lengths")
+    # the tree wraps periodic axes itself, a box length of 0 leaves an axis open
+    wrapped = wrap(coors, box, pbc)
+    pairs = cKDTree(wrapped, boxsize=np.where(pbc, box, 0.0)).query_pairs(cutoff, output_type='ndarray')
+    diff = coors[pairs[:, 0]] - coors[pairs[:, 1]]
+    diff[:, pbc] -= box[pbc] * np.round(diff[:, pbc] / box[pbc])
+    dist = np.sqrt(np.sum(diff ** 2, axis=1))
+    return pairs[dist < cutoff]
+
+
+def pairs_to_csr(pairs, natoms):
+    '''
+    symmetric adjacency matrix (CSR, int32 indices, int8 data) of the
+    pairs (i, j), column indices sorted within each row
+    '''
+    rows = np.concatenate((pairs[:, 0], pairs[:, 1])).astype(np.int32)
+    cols = np.concatenate((pairs[:, 1], pairs[:, 0])).astype(np.int32)
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(natoms + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=natoms))
+    data = np.ones(cols.shape[0], dtype=np.int8)
+    return csr_matrix((data, cols[order], indptr), shape=(natoms, natoms))
+
+
+class NeighborGraph:
+    '''
+    graph of atoms closer than cutoff, stored as a sparse adjacency matrix
+    in CSR format with int32 indices
+    the neighbors of atom i are indices[indptr[i]:indptr[i + 1]], in
+    ascending order
+    box and pbc make the graph periodic (e.g. pbc=(True, True, False) for
+    slab models), see neighbor_pairs
+
+    atoms can be added and removed with add_atoms/remove_atoms, which
+    update the coordination numbers and the sums of neighbor coordination
+    numbers (for GCN) of the affected neighborhood only
+    atom indices are stable: removed atoms stay as isolated, dead entries
+    until compact() is called
+    coors are kept without a copy and must not be modified afterwards
+    '''
+    def __init__(self, coors, cutoff, box=None, pbc=None):
+        coors = np.asarray(coors, dtype=float)
+        self.cutoff = cutoff
+        self.box = None if box is None else np.asarray(box, dtype=float)
+        self.pbc = None
+        if box is not None:
+            self.pbc = np.ones(3, dtype=bool) if pbc is None else np.asarray(pbc, dtype=bool)
+        self._build(coors)
+
+    def _build(self, coors):
+        pairs = neighbor_pairs(coors, self.cutoff, self.box, self.pbc)
+        self._set_adjacency(coors, pairs_to_csr(pairs, coors.shape[0]))
+
+    def _set_adjacency(self, coors, adjacency):
+        n = coors.shape[0]
+        self._adjacency = adjacency
+        self._rows = {}  # rows edited since the CSR matrix was built
+        self._n = n
+        self._coors = coors  # not copied, add_atoms writes to a resized array
+        self._alive = np.ones(n, dtype=bool)
+        self._cn = np.diff(self._adjacency.indptr).astype(np.int64)
+        self._accum = self._adjacency @ self._cn  # sum of cn of the neighbors
+        self._tree = None  # built on the first add_atoms
+        self._tree_size = n
+        self._untracked = 0  # number of atoms added after the tree was built
+        self._cells = {}  # cell of side cutoff -> atoms added after the tree was built
+        # periodic axes hold a whole number of cells of side >= cutoff
+        self._ncell = None if self.box is None else np.floor(self.box / self.cutoff).astype(np.int64)
+
+    def _wrap(self, coors):
+        if self.box is None:
+            return coors
+        return wrap(coors, self.box, self.pbc)
+
+    def _boxsize(self):
+        return None if self.box is None else np.where(self.pbc, self.box, 0.0)
+
+    def _cell(self, xyz):
+        # cell of an atom in the grid of the atoms added since the tree was built
+        cell = np.floor(self._wrap(xyz) / self.cutoff).astype(np.int64)
+        if self.box is not None:
+            cell[self.pbc] = np.minimum(cell[self.pbc], self._ncell[self.pbc] - 1)
+        return cell
+
+    def _untracked_near(self, xyz):
+        # atoms added since the tree was built in the 27 cells around xyz
+        keys = self._cell(xyz) + np.array(list(np.ndindex(3, 3, 3))) - 1
+        if self.box is not None:
+            keys[:, self.pbc] %= self._ncell[self.pbc]
+        return [j for key in set(map(tuple, keys.tolist())) for j in self._cells.get(key, ())]
+
+    def _distance(self, xyz, idx):
+        diff = self._coors[idx] - xyz
+        if self.box is not None:
+            diff[:, self.pbc] -= self.box[self.pbc] * np.round(diff[:, self.pbc] / self.box[self.pbc])
+        return np.sqrt(np.sum(diff ** 2, axis=1))
+
+    @property
+    def nAtoms(self):
+        return self._n
+
+    @property
+    def coors(self):
+        return self._coors[:self._n]
+
+    @property
+    def alive(self):
+        return self._alive[:self._n]
+
+    @property
+    def adjacency(self):
+        if self._rows or self._adjacency.shape[0] != self._n:
+            self._rebuild_csr()
+        return self._adjacency
+
+    @property
+    def indptr(self):
+        return self.adjacency.indptr
+
+    @property
+    def indices(self):
+        return self.adjacency.indices
+
+    def coordination(self):
+        '''
+        number of neighbors of each atom
+        '''
+        return self._cn[:self._n].copy()
+
+    def gcn(self, cn_max):
+        '''
+        generalized coordination number of each atom, cn_max is the
+        coordination number of bulk atoms
+        '''
+        return self._accum[:self._n] / cn_max
+
+    def neighbors(self, i):
+        if i in self._rows:
+            return np.array(sorted(self._rows[i]), dtype=np.int32)
+        if i >= self._adjacency.shape[0]:
+            return np.empty(0, dtype=np.int32)
+        indptr = self._adjacency.indptr
+        return self._adjacency.indices[indptr[i]:indptr[i + 1]]
+
+    def _row(self, i):
+        # editable neighbor set of atom i
+        if i not in self._rows:
+            self._rows[i] = set(self.neighbors(i).tolist())
+        return self._rows[i]
+
+    def _rebuild_csr(self):
+        csr = self._adjacency
+        rows = np.repeat(np.arange(csr.shape[0]), np.diff(csr.indptr))
+        keep = np.ones(rows.shape[0], dtype=bool)
+        if self._rows:
+            edited = np.zeros(self._n, dtype=bool)
+            edited[list(self._rows)] = True
+            keep = ~edited[rows]
+        new_rows = [np.full(len(row), i) for i, row in self._rows.items()]
+        new_cols = [np.fromiter(row, dtype=np.int64, count=len(row)) for row in self._rows.values()]
+        rows = np.concatenate([rows[keep]] + new_rows).astype(np.int32)
+        cols = np.concatenate([csr.indices[keep]] + new_cols).astype(np.int32)
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(self._n + 1, dtype=np.int32)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=self._n))
+        data = np.ones(cols.shape[0], dtype=np.int8)
+        self._adjacency = csr_matrix((data, cols[order], indptr), shape=(self._n, self._n))
+        self._rows = {}
+
+    def _add_edge(self, i, j):
+        for m in self._row(i):
+            self._accum[m] += 1
+        for m in self._row(j):
+            self._accum[m] += 1
+        self._cn[i] += 1
+        self._cn[j] += 1
+        self._rows[i].add(j)
+        self._rows[j].add(i)
+        self._accum[i] += self._cn[j]
+        self._accum[j] += self._cn[i]
+
+    def _remove_edge(self, i, j):
+        self._row(i).discard(j)
+        self._row(j).discard(i)
+        self._accum[i] -= self._cn[j]
+        self._accum[j] -= self._cn[i]
+        self._cn[i] -= 1
+        self._cn[j] -= 1
+        for m in self._rows[i]:
+            self._accum[m] -= 1
+        for m in self._rows[j]:
+            self._accum[m] -= 1
+
+    def add_atoms(self, coors):
+        '''
+        add atoms at coors, return their indices
+        '''
+        coors = np.asarray(coors, dtype=float).reshape(-1, 3)
+        if self._tree is None:
+            self._tree = cKDTree(self._wrap(self.coors[:self._tree_size]), boxsize=self._boxsize())
+        new = []
+        for xyz in coors:
+            if self._n == self._coors.shape[0]:
+                capacity = max(2 * self._n, 16)
+                self._coors = np.resize(self._coors, (capacity, 3))
+                self._alive = np.resize(self._alive, capacity)
+                self._cn = np.resize(self._cn, capacity)
+                self._accum = np.resize(self._accum, capacity)
+            i = self._n
+            candidates = self._tree.query_ball_point(self._wrap(xyz), self.cutoff)
+            candidates = np.array(candidates + self._untracked_near(xyz), dtype=np.int64)
+            candidates = candidates[self._alive[candidates]]
+            nbrs = candidates[self._distance(xyz, candidates) < self.cutoff]
+            self._coors[i] = xyz
+            self._alive[i] = True
+            self._cn[i] = 0
+            self._accum[i] = 0
+            self._rows[i] = set()
+            self._n += 1
+            for j in nbrs:
+                self._add_edge(i, int(j))
+            self._cells.setdefault(tuple(self._cell(xyz).tolist()), []).append(i)
+            self._untracked += 1
+            new.append(i)
+        if self._untracked > max(1024, self._tree_size // 10):
+            self._tree = cKDTree(self._wrap(self.coors), boxsize=self._boxsize())
+            self._tree_size = self._n
+            self._untracked = 0
+            self._cells = {}
+        return np.array(new, dtype=np.int64)
+
+    def remove_atoms(self, indices):
+        '''
+        remove the atoms of indices, they are kept as dead entries
+        '''
+        for i in np.atleast_1d(indices):
+            i = int(i)
+            if not self._alive[i]:
+                continue
+            for j in list(self._row(i)):
+                self._remove_edge(i, j)
+            self._alive[i] = False
+
+    def subgraph(self, indices):
+        '''
+        graph of the atoms of indices (in this order), the bonds between
+        them are taken from this graph instead of being searched again
+        '''
+        indices = np.asarray(indices)
+        graph = NeighborGraph.__new__(NeighborGraph)
+        graph.cutoff, graph.box, graph.pbc = self.cutoff, self.box, self.pbc
+        adjacency = self.adjacency[indices][:, indices]
+        adjacency.sort_indices()
+        adjacency.indices = adjacency.indices.astype(np.int32)
+        adjacency.indptr = adjacency.indptr.astype(np.int32)
+        graph._set_adjacency(self.coors[indices], adjacency)
+        return graph
+
+    def compact(self):
+        '''
+        drop the removed atoms and renumber the others
+        return the former indices of the atoms kept
+        '''
+        kept = np.flatnonzero(self.alive)
+        self._build(self.coors[kept])
+        return kept
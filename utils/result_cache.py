@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the results of the MSR module
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+
+
+def code_version(paths):
+    '''
+    sha256 of the source files of paths, results computed by another
+    version of the code are not reused
+    '''
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''
+    LRU cache of MSR results on disk, one .npz file of arrays per run named
+    by the sha256 of the normalized inputs of the run and of the code version
+    maxbytes limits the total size of the files, the least recently used
+    ones (by modification time, updated on each hit) are removed first
+    '''
+    def __init__(self, directory, maxbytes, version=''):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, params):
+        '''
+        hash of params, a dict of JSON serializable inputs
+        '''
+        text = json.dumps({'version': self.version, 'params': params}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def files(self):
+        # (mtime, size, path) of the cached files, least recently used first
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self.files())
+
+    def clear(self):
+        for _, _, path in self.files():
+            self._remove(path)
+
+    def load(self, key):
+        '''
+        dict of the arrays saved under key, None if there are none
+        '''
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # broken file, e.g. left by a run killed while writing
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            # mark the file as recently used, a read-only cache only loses the LRU order
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return arrays
+
+    def save(self, key, arrays):
+        '''
+        save the dict of arrays under key, then remove the least recently
+        used files until the cache fits in maxbytes
+        the cache is only an optimization, errors of the file system (e.g.
+        a file opened by another process on Windows) are ignored
+        return True if the arrays were saved
+        '''
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write to a temporary file first so other processes never read a partial file
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(fp, **arrays)
+            os.replace(tmp, self.path(key))
+        except OSError:
+            if tmp is not None:
+                self._remove(tmp)
+            return False
+        except BaseException:
+            if tmp is not None:
+                self._remove(tmp)
+            raise
+        self.evict()
+        return True
+
+    def evict(self):
+        '''
+        remove the least recently used files until the cache fits in maxbytes
+        '''
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.maxbytes:
+                break
+            if self._remove(path):
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        # files still opened by another process cannot be removed on Windows
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        return True
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel (T, P, composition) sweeps of the MSR module
+"""
+
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+try:
+    from utils.msr import Wulff
+except ImportError:
+    from msr import Wulff
+
+
+def sweep_point(args):
+    '''
+    run MSR on one point, args = (n, values, condition) where condition is
+    (T, P) or (T, P, composition), composition being the percentage of
+    each gas of values
+    return a row of the sweep table
+    '''
+    n, values, condition = args
+    row = {'point': n, 'T': float(condition[0]), 'P': float(condition[1])}
+    try:
+        wulff = Wulff()
+        wulff.write_files = False
+        flag, message = wulff.get_para(values)
+        if flag:
+            wulff.set_conditions(*condition)
+            for i, pp in enumerate(wulff.pp):
+                row[f'pp{i+1}'] = pp
+            flag, message = wulff.run()
+        row['flag'] = int(flag)
+        row['message'] = message
+        if not flag:
+            return row
+        row['nAtoms'] = int(wulff.nAtoms)
+        row['nBulk'] = wulff.nBulk
+        # faceinfo table, one column per face and row
+        for name, record in wulff.record_df.iterrows():
+            for face, value in record.items():
+                if value != '/':
+                    row[f'{face} {name}'] = float(value)
+        counts = np.bincount(wulff.siteCodes, minlength=len(wulff.siteTable))
+        for label, count in zip(wulff.siteTable, counts):
+            row[f'sites {label.strip()}'] = int(count)
+    except Exception as e:
+        # a failed point must not stop the other points of the sweep
+        row['flag'] = 0
+        row['message'] = str(e)
+    return row
+
+
+def iter_sweep(values, conditions, processes=None):
+    '''
+    run MSR on each point of conditions with the inputs values (as saved by
+    InputPanel) on a pool of processes, yield the rows of the points as
+    they are done
+    '''
+    tasks = [(n, values, condition) for n, condition in enumerate(conditions)]
+    processes = min(processes or os.cpu_count(), max(len(tasks), 1))
+    with Pool(processes) as pool:
+        for row in pool.imap_unordered(sweep_point, tasks):
+            yield row
+
+
+def run_sweep(values, conditions, processes=None, callback=None):
+    '''
+    run MSR on each (T, P) or (T, P, composition) point of conditions on
+    all cores, callback(row) is called as each point is done
+    return a DataFrame with one row per point, in the order of conditions
+    '''
+    rows = []
+    for row in iter_sweep(values, conditions, processes):
+        rows.append(row)
+        if callback is not None:
+            callback(row)
+    table = pd.DataFrame(rows)
+    if rows:
+        table = table.sort_values('point').set_index('point')
+    return table
@@ -246,15 +246,19 @@ class InputPanel(wx.ScrolledWindow):
         sj_start = time.time()
         self.__save()
         wulff = Wulff()
+        # tracing memory slows down the python loops, so it is off unless asked for
+        wulff.profile_memory = self.msrPane.traceMemory.GetValue()
 
         flag, message = wulff.get_para(self.values)
         if flag:
-            wulff.gen_coverage()
-            flag, message = wulff.geometry()
+            flag, message = wulff.run()
             if flag:
                 self.log.WriteText(wulff.record_df)
+                self.log.WriteText(f"Lattice atoms generated: {wulff.nBulk}, kept: {wulff.nAtoms}")
+                self.log.WriteText(wulff.stage_report())
                 sj_elapsed = round(time.time() - sj_start, 4)
-                NP = NanoParticle(wulff.eles, wulff.positions, wulff.siteTypes)
+                NP = NanoParticle(wulff.eles, wulff.positions, wulff.siteCodes,
+                                  siteTable=wulff.siteTable)
                 self.particle = NP
                 q = 'MSR Job Completed. Total Cost About: ' + str(sj_elapsed) + ' Seconds\n'
                 self.log.WriteText(q)
@@ -364,6 +368,10 @@ class MsrPanel(wx.CollapsiblePane):
         box.Add(wx.StaticText(self.win, -1, "Radius (\u00C5)"), 0, wx.ALIGN_CENTER|wx.ALL, 8)
         box.AddSpacer(8)
         box.Add(wgt, 0, wx.ALIGN_CENTER|wx.ALL, 8)
+        box.AddSpacer(24)
+        # not an input of the model, kept out of entries
+        self.traceMemory = wx.CheckBox(self.win, -1, "Trace memory (slower)")
+        box.Add(self.traceMemory, 0, wx.ALIGN_CENTER|wx.ALL, 8)
         self.Box.Add(box)
 
     def __initGasesBox(self):
@@ -62,14 +62,22 @@ def get_type_color(type):
 
 
 class NanoParticle:
-    def __init__(self, eles, positions, siteTypes=None, covTypes=None):
+    def __init__(self, eles, positions, siteTypes=None, covTypes=None, siteTable=None):
+        # siteTypes: label of each atom, or its code in siteTable if given
         self.colorlist = []
         if isinstance(eles, str):
             self.eles = [eles for i in range(len(positions))]
         else:
             self.eles = np.array(eles)
         self.positions = np.array(positions)
-        self.siteTypes = np.array(siteTypes)
+        self.siteCodes = None
+        self.siteTable = None
+        if siteTable is not None:
+            self.siteCodes = np.asarray(siteTypes)
+            self.siteTable = np.asarray(siteTable)
+        elif siteTypes is not None:
+            self.siteTable, codes = np.unique(siteTypes, return_inverse=True)
+            self.siteCodes = codes.astype(np.int8 if len(self.siteTable) <= 128 else np.int16)
         self.covTypes = np.array(covTypes)
         self.colors = np.zeros((len(self.eles), 3))
         self.nAtoms = len(self.eles)
@@ -86,15 +94,30 @@ class NanoParticle:
             for i, ele in enumerate(self.eles):
                 self.colors[i] = get_ele_color(ele)
         elif coltype == 'site_type':
-            for i, type in enumerate(self.siteTypes):
-                type = type.strip()
-                self.colors[i] = get_type_color(type)
+            table_colors = np.array([get_type_color(type.strip()) for type in self.siteTable])
+            self.colors = table_colors[self.siteCodes]
         elif coltype == 'GCN':
             self.colors = self.gcnColors.copy()
         else:
             if self.TOFcolors.get(coltype):
                 self.colors = self.TOFcolors[coltype].copy()
     
+    @property
+    def siteTypes(self):
+        # label of each atom
+        if self.siteCodes is None:
+            return None
+        return self.siteTable[self.siteCodes]
+
+    def sumBySite(self, values=None):
+        '''
+        sum of values (e.g. TOFs) over the atoms of each site type of
+        siteTable, number of atoms of each site type if values is None
+        '''
+        if values is not None:
+            values = np.ravel(values)
+        return np.bincount(self.siteCodes, weights=values, minlength=len(self.siteTable))
+
     def addColorGCN(self, GCNs):
         GCNs = np.array(GCNs)
         min = GCNs.min()
@@ -304,11 +304,12 @@ class glPanel(wx.Panel):
                     f.write('%d\n' % (p.nAtoms))
                     f.write('%s\n' % (p.coltype))
                     if p.coltype == 'site_type':
+                        siteTypes = p.siteTypes
                         for i in range(p.nAtoms):
                             f.write('%s  %.3f  %.3f  %.3f  %s\n' %
                                     (p.eles[i], p.positions[i][0], 
                                     p.positions[i][1], p.positions[i][2], 
-                                    p.siteTypes[i]))
+                                    siteTypes[i]))
                     elif p.coltype == 'GCN':
                         for i in range(p.nAtoms):
                             f.write('%s  %.3f  %.3f  %.3f  %.3f\n' %